@@ -24,13 +24,13 @@ import argparse
 import numpy as np
 import simpy
 from colorama import init, Fore
-from event_bus import EventBus
 
 import sim_primitives.coins as coins
 import sim_primitives.mining_params as mining_params
 from sim_primitives.miner import Miner
 from sim_primitives.network import Connection, ConnectionFactory
 from sim_primitives.pool import Pool
+from sim_primitives.protocol import SimEventBus
 from sim_primitives.proxy import Proxy
 from sim_primitives.stratum_v1.miner import MinerV1
 from sim_primitives.stratum_v1.pool import PoolV1
@@ -40,7 +40,7 @@ from sim_primitives.stratum_v2.pool import PoolV2
 from sim_primitives.stratum_v2.proxy import V2ToV1Translation
 
 init()
-bus = EventBus()
+bus = SimEventBus()
 
 
 def main():
@@ -27,10 +27,15 @@ class Target:
     def __init__(self, target: int, diff_1_target: int):
         self.target = target
         self.diff_1_target = diff_1_target
+        # Cached result of to_difficulty(), any change of the target has to reset it
+        self._difficulty = None
 
     def to_difficulty(self):
         """Converts target to difficulty at the network specified by diff_1_target"""
-        return self.diff_1_target // self.target
+        difficulty = self._difficulty
+        if difficulty is None:
+            difficulty = self._difficulty = self.diff_1_target // self.target
+        return difficulty
 
     @staticmethod
     def from_difficulty(diff, diff_1_target):
@@ -39,6 +44,7 @@ class Target:
 
     def div_by_factor(self, factor: float):
         self.target = self.target // factor
+        self._difficulty = None
 
     def __str__(self):
         return '{}(diff={})'.format(type(self).__name__, self.to_difficulty())
@@ -24,6 +24,7 @@
 this class estimates miner speed from reported shares
 implemented using rolling time window
 the HashrateMeter.roll method is called automatically each 5 seconds by default (granularity = 5)
+the window is stored in ring buffers, the slot being currently filled is at index 'head'
 """
 import numpy as np
 import simpy
@@ -44,15 +45,17 @@ class HashrateMeter(object):
         self.pow_buffer = np.zeros(self.window_size // self.granularity)
         self.submit_buffer = np.zeros(self.window_size // self.granularity)
         self.frozen_time_buffer = np.zeros(self.window_size // self.granularity)
+        self.head = 0
         self.roll_proc = env.process(self.roll())
         self.auto_hold_threshold = auto_hold_threshold
         self.on_hold = False
         self.put_on_hold_proc = None
 
     def reset(self, time_started):
-        self.pow_buffer = np.zeros(self.window_size // self.granularity)
-        self.submit_buffer = np.zeros(self.window_size // self.granularity)
-        self.frozen_time_buffer = np.zeros(self.window_size // self.granularity)
+        self.pow_buffer.fill(0)
+        self.submit_buffer.fill(0)
+        self.frozen_time_buffer.fill(0)
+        self.head = 0
         self.time_started = time_started
         if self.put_on_hold_proc:
             self.put_on_hold_proc.interrupt()  # terminate the current auto-on-hold process if exists
@@ -62,14 +65,14 @@ class HashrateMeter(object):
             try:
                 yield self.env.timeout(self.granularity)
                 if not self.on_hold:
-                    self.pow_buffer = np.roll(self.pow_buffer, 1)
-                    self.pow_buffer[0] = 0
-                    self.submit_buffer = np.roll(self.submit_buffer, 1)
-                    self.submit_buffer[0] = 0
-                    self.frozen_time_buffer = np.roll(self.frozen_time_buffer, 1)
-                    self.frozen_time_buffer[0] = 0
+                    # Advance the head instead of shifting the buffers, the oldest
+                    # slot is reused for the new period
+                    self.head = (self.head + 1) % len(self.pow_buffer)
+                    self.pow_buffer[self.head] = 0
+                    self.submit_buffer[self.head] = 0
+                    self.frozen_time_buffer[self.head] = 0
                 else:
-                    self.frozen_time_buffer[0] += self.granularity
+                    self.frozen_time_buffer[self.head] += self.granularity
             except simpy.Interrupt:
                 break
 
@@ -86,8 +89,8 @@ class HashrateMeter(object):
 
         TODO: consider changing the interface to accept the difficulty target directly
         """
-        self.pow_buffer[0] += share_diff
-        self.submit_buffer[0] += 1
+        self.pow_buffer[self.head] += share_diff
+        self.submit_buffer[self.head] += 1
         self.on_hold = False  # reset frozen status whenever a share is submitted
         if self.auto_hold_threshold:
             if self.put_on_hold_proc:
@@ -20,23 +20,32 @@
 # of such proprietary license or if you have any other questions, please
 # contact us at opensource@braiins.com.
 
+import collections
+
 import numpy as np
 import simpy
-from event_bus import EventBus
 
 import sim_primitives.coins as coins
 from sim_primitives.hashrate_meter import HashrateMeter
 from sim_primitives.network import Connection
 from sim_primitives.pool import MiningSession, MiningJob
-from sim_primitives.protocol import DownstreamConnectionProcessor
+from sim_primitives.protocol import DownstreamConnectionProcessor, SimEventBus
+
+# Device parameters extracted from the device information of the miner
+DeviceSpec = collections.namedtuple(
+    'DeviceSpec', ('vendor', 'hardware_version', 'firmware', 'device_id', 'speed_ghps')
+)
 
 
 class Miner(object):
+    # Number of share time samples drawn at once from the exponential distribution
+    luck_batch_size = 1024
+
     def __init__(
         self,
         name: str,
         env: simpy.Environment,
-        bus: EventBus,
+        bus: SimEventBus,
         diff_1_target: int,
         protocol_type: DownstreamConnectionProcessor,
         device_information: dict,
@@ -50,6 +59,13 @@ class Miner(object):
         self.diff_1_target = diff_1_target
         self.protocol_type = protocol_type
         self.device_information = device_information
+        self.device_spec = DeviceSpec(
+            vendor=device_information.get('vendor', 'unknown'),
+            hardware_version=device_information.get('hardware_version', 'unknown'),
+            firmware=device_information.get('firmware', 'unknown'),
+            device_id=device_information.get('device_id', ''),
+            speed_ghps=device_information.get('speed_ghps'),
+        )
         self.connection_processor = None
         self.work_meter = HashrateMeter(env)
         self.mine_proc = None
@@ -58,22 +74,26 @@ class Miner(object):
         self.recv_loop_process = None
         self.is_mining = True
         self.simulate_luck = simulate_luck
+        # Pre-drawn share times in multiples of the average share time, consumed from
+        # the end
+        self.luck_samples = []
 
     def get_actual_speed(self):
-        return self.device_information.get('speed_ghps') if self.is_mining else 0
+        return self.device_spec.speed_ghps if self.is_mining else 0
 
     def mine(self, job: MiningJob):
         share_diff = job.diff_target.to_difficulty()
-        avg_time = share_diff * 4.294967296 / self.device_information.get('speed_ghps')
+        avg_time = share_diff * 4.294967296 / self.device_spec.speed_ghps
 
         # Report the current hashrate at the beginning when of mining
         self.__emit_hashrate_msg_on_bus(job, avg_time)
 
         while True:
+            share_time = (
+                avg_time * self.__draw_luck() if self.simulate_luck else avg_time
+            )
             try:
-                yield self.env.timeout(
-                    np.random.exponential(avg_time) if self.simulate_luck else avg_time
-                )
+                yield self.env.timeout(share_time)
             except simpy.Interrupt:
                 self.__emit_aux_msg_on_bus('Mining aborted (external signal)')
                 break
@@ -86,6 +106,14 @@ class Miner(object):
 
                 self.connection_processor.submit_mining_solution(job)
 
+    def __draw_luck(self):
+        """Draws the next share time relative to the average share time"""
+        if not self.luck_samples:
+            self.luck_samples = np.random.standard_exponential(
+                self.luck_batch_size
+            ).tolist()
+        return self.luck_samples.pop()
+
     def connect_to_pool(self, connection: Connection, target):
         assert self.connection_processor is None, 'BUG: miner is already connected'
         connection.connect_to(target)
@@ -46,17 +46,26 @@ class AcceptingConnection(ABC):
 class ConnectionStore:
     """This class represents the propagation network connection."""
 
+    # Number of latency samples drawn at once from the normal distribution
+    latency_batch_size = 1024
+
     def __init__(self, env, mean_latency, latency_stddev_percent):
         self.env = env
         self.mean_latency = mean_latency
         self.latency_stddev = 0.01 * latency_stddev_percent * mean_latency
         self.store = simpy.Store(env)
+        # Pre-drawn latency samples, consumed from the end
+        self.latency_samples = []
 
     def latency(self):
         if self.latency_stddev < 0.00001:
             delay = self.mean_latency
         else:
-            delay = np.random.normal(self.mean_latency, self.latency_stddev)
+            if not self.latency_samples:
+                self.latency_samples = np.random.normal(
+                    self.mean_latency, self.latency_stddev, self.latency_batch_size
+                ).tolist()
+            delay = self.latency_samples.pop()
         yield self.env.timeout(delay)
 
     def put(self, value):
@@ -21,15 +21,16 @@
 # contact us at opensource@braiins.com.
 
 """Generic pool module"""
+import enum
 import hashlib
+import itertools
 
 import numpy as np
 import simpy
-from event_bus import EventBus
 
 import sim_primitives.coins as coins
 from sim_primitives.hashrate_meter import HashrateMeter
-from sim_primitives.protocol import UpstreamConnectionProcessor
+from sim_primitives.protocol import SimEventBus, UpstreamConnectionProcessor
 from sim_primitives.network import Connection, AcceptingConnection
 
 
@@ -46,6 +47,14 @@ class MiningJob:
         self.diff_target = diff_target
 
 
+class JobState(enum.Enum):
+    """Result of a job lookup in the registry"""
+
+    VALID = enum.auto()
+    STALE = enum.auto()
+    UNKNOWN = enum.auto()
+
+
 class MiningJobRegistry:
     """Registry of jobs that have been assigned for mining.
 
@@ -54,8 +63,8 @@ class MiningJobRegistry:
     the retire_all_jobs() can be adjusted accordingly"""
 
     def __init__(self):
-        # Tracking minimum valid job ID
-        self.next_job_uid = 0
+        # Source of job ID's for this registry
+        self.job_uids = itertools.count()
         # Registered jobs based on their uid
         self.jobs = dict()
         # Invalidated jobs just for accounting reasons
@@ -70,7 +79,7 @@ class MiningJobRegistry:
         :return new mining job or None if job with the specified ID already exists
         """
         if job_id is None:
-            job_id = self.__next_job_uid()
+            job_id = next(self.job_uids)
         if job_id not in self.jobs:
             new_job = MiningJob(uid=job_id, diff_target=diff_target)
             self.jobs[new_job.uid] = new_job
@@ -91,6 +100,20 @@ class MiningJobRegistry:
     def get_invalid_job_diff_target(self, job_uid):
         return self.invalid_jobs[job_uid].diff_target
 
+    def get_job_state_and_diff_target(self, job_uid):
+        """Looks up the job among valid jobs first and then among invalidated jobs.
+
+        :return: tuple of the job state and the difficulty target of the job (None
+        for an unknown job)
+        """
+        job = self.jobs.get(job_uid)
+        if job is not None:
+            return JobState.VALID, job.diff_target
+        job = self.invalid_jobs.get(job_uid)
+        if job is not None:
+            return JobState.STALE, job.diff_target
+        return JobState.UNKNOWN, None
+
     def contains(self, job_uid):
         """Job ID presence check
         :return True when when such Job ID exists in the registry (it may still not
@@ -119,18 +142,25 @@ class MiningJobRegistry:
         ), 'Job {} already exists in the registry'.format(job)
         self.jobs[job.uid] = job
 
-    def __next_job_uid(self):
-        """Initializes a new job ID for this session.
-        """
-        curr_job_uid = self.next_job_uid
-        self.next_job_uid += 1
-
-        return curr_job_uid
-
 
 class MiningSession:
     """Represents a mining session that can adjust its difficulty target"""
 
+    __slots__ = (
+        'name',
+        'env',
+        'bus',
+        'owner',
+        'curr_diff_target',
+        'enable_vardiff',
+        'meter',
+        'vardiff_process',
+        'vardiff_time_window_size',
+        'vardiff_desired_submits_per_sec',
+        'on_vardiff_change',
+        'job_registry',
+    )
+
     min_factor = 0.25
     max_factor = 4
 
@@ -138,7 +168,7 @@ class MiningSession:
         self,
         name: str,
         env: simpy.Environment,
-        bus: EventBus,
+        bus: SimEventBus,
         owner,
         diff_target: coins.Target,
         enable_vardiff,
@@ -239,7 +269,7 @@ class Pool(AcceptingConnection):
         self,
         name: str,
         env: simpy.Environment,
-        bus: EventBus,
+        bus: SimEventBus,
         protocol_type: UpstreamConnectionProcessor,
         default_target: coins.Target,
         extranonce2_size: int = 8,
@@ -340,17 +370,16 @@ class Pool(AcceptingConnection):
     def process_submit(
         self, submit_job_uid, session: MiningSession, on_accept, on_reject
     ):
-        if session.job_registry.contains(submit_job_uid):
-            diff_target = session.job_registry.get_job_diff_target(submit_job_uid)
+        job_state, diff_target = session.job_registry.get_job_state_and_diff_target(
+            submit_job_uid
+        )
+        if job_state is JobState.VALID:
             # Global accounting
             self.account_accepted_shares(diff_target)
             # Per session accounting
             session.account_diff_shares(diff_target.to_difficulty())
             on_accept(diff_target)
-        elif session.job_registry.contains_invalid(submit_job_uid):
-            diff_target = session.job_registry.get_invalid_job_diff_target(
-                submit_job_uid
-            )
+        elif job_state is JobState.STALE:
             self.account_stale_shares(diff_target)
             on_reject(diff_target)
         else:
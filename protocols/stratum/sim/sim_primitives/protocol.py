@@ -21,6 +21,8 @@
 # contact us at opensource@braiins.com.
 
 """Generic protocol primitives"""
+import collections
+
 import stringcase
 from abc import abstractmethod
 
@@ -30,6 +32,36 @@ from event_bus import EventBus
 from sim_primitives.network import Connection
 
 
+class SimEventBus(EventBus):
+    """Event bus that tells whether any function is subscribed to an event
+
+    Nodes use it to skip formatting log messages that nobody listens to. Listeners
+    may subscribe at any time.
+    """
+
+    __slots__ = ('_listeners',)
+
+    def __init__(self):
+        super().__init__()
+        # Subscribed functions indexed by event, kept next to the registry of
+        # EventBus that has no public accessor
+        self._listeners = collections.defaultdict(set)
+
+    def add_event(self, func, event: str):
+        super().add_event(func, event)
+        self._listeners[event].add(func)
+
+    def remove_event(self, func_name: str, event: str):
+        super().remove_event(func_name, event)
+        self._listeners[event] = {
+            func for func in self._listeners[event] if func.__name__ != func_name
+        }
+
+    def has_listeners(self, event: str) -> bool:
+        # Unlike indexing, get() doesn't create an empty set for unknown events
+        return bool(self._listeners.get(event))
+
+
 class Message:
     """Generic message that accepts visitors and dispatches their processing."""
 
@@ -42,85 +74,216 @@ class Message:
         def __str__(self):
             return self.method_name
 
+    __slots__ = ('req_id',)
+
+    # All message classes indexed by the name of the visitor method that processes
+    # them. Multiple protocols may define a message of the same name (e.g. Reconnect)
+    visitor_registry = collections.defaultdict(list)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.visit_method_name = 'visit_{}'.format(stringcase.snakecase(cls.__name__))
+        Message.visitor_registry[cls.visit_method_name].append(cls)
+        cls._NAME_PREFIX = cls.__name__ + '('
+
     def __init__(self, req_id=None):
+        # Subclasses with their own constructor assign req_id directly instead of
+        # chaining up here
         self.req_id = req_id
 
     def accept(self, visitor):
-        """Call visitor method based on the actual message type."""
-        method_name = 'visit_{}'.format(stringcase.snakecase(type(self).__name__))
+        """Call visitor method based on the actual message type.
+
+        The visitor method name has been resolved when the message class was created.
+        """
         try:
-            visit_method = getattr(visitor, method_name)
+            visit_method = getattr(visitor, self.visit_method_name)
         except AttributeError:
-            raise self.VisitorMethodNotImplemented(method_name)
+            raise self.VisitorMethodNotImplemented(self.visit_method_name)
 
         visit_method(self)
 
-    def _format(self, content):
-        return '{}({})'.format(type(self).__name__, content)
+    def _format(self, content: str):
+        return self._NAME_PREFIX + content + ')'
 
 
 class RequestRegistry:
-    """Generates unique request ID for messages and provides simple registry"""
+    """Generates unique request ID for messages and provides simple registry
+
+    Requests are stored in a fixed ring of slots indexed by the low bits of the request
+    ID. Only a few requests are outstanding on a connection at any time. A request
+    that is still unanswered when its slot is reused is evicted, its late response is
+    then treated as a response to an unknown request.
+    """
+
+    # Number of slots, has to be a power of 2
+    size = 256
 
     def __init__(self):
         self.next_req_id = 0
-        self.requests = dict()
+        self.slot_mask = self.size - 1
+        self.slots = [None] * self.size
 
     def push(self, req: Message):
-        """Assigns a unique request ID to a message and registers it"""
-        req.req_id = self.__next_req_id()
-        assert (
-            self.requests.get(req.req_id) is None
-        ), 'BUG: request ID already present {}'.format(req.req_id)
-        self.requests[req.req_id] = req
+        """Assigns a unique request ID to a message and registers it
+
+        :return: the evicted unanswered request or None
+        """
+        req_id = self.next_req_id
+        self.next_req_id = req_id + 1
+        req.req_id = req_id
+        slot = req_id & self.slot_mask
+        evicted_req = self.slots[slot]
+        self.slots[slot] = req
+        return evicted_req
 
     def pop(self, req_id):
-        return self.requests.pop(req_id, None)
+        """Removes the request from the registry
 
-    def __next_req_id(self):
-        curr_req_id = self.next_req_id
-        self.next_req_id += 1
-        return curr_req_id
+        :return: the request or None when no such request is registered
+        """
+        if req_id is None:
+            return None
+        slot = req_id & self.slot_mask
+        req = self.slots[slot]
+        if req is None or req.req_id != req_id:
+            return None
+        self.slots[slot] = None
+        return req
+
+    def clear(self):
+        """Forgets all outstanding requests, e.g. when the connection is reset"""
+        self.slots = [None] * self.size
 
 
 class ConnectionProcessor:
-    """Receives and dispatches a message on a single connection."""
+    """Receives and dispatches a message on a single connection.
+
+    Each subclass gets its own _dispatch() method generated at class creation time.
+    The method maps the message type directly to the visitor function of the class and
+    falls back to Message.accept() only for message types that are not known at that
+    time.
+    """
+
+    __slots__ = (
+        'name',
+        'env',
+        'bus',
+        'connection',
+        'send_store',
+        'recv_store',
+        'request_registry',
+        'receive_loop_process',
+    )
+
+    # Message types that dominate the traffic of a particular processor, they are
+    # checked first by the generated dispatch method
+    _fast_path_messages = ()
+
+    # Direction in which the processor accesses the connection, see
+    # UpstreamConnectionProcessor and DownstreamConnectionProcessor
+    is_upstream = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch = cls._build_dispatch()
+
+    @classmethod
+    def _build_dispatch(cls):
+        """Generate dispatch method for all visitor methods that the class provides"""
+        msg_classes = list(cls._fast_path_messages)
+        for method_name in sorted(n for n in dir(cls) if n.startswith('visit_')):
+            msg_classes.extend(
+                msg_cls
+                for msg_cls in Message.visitor_registry.get(method_name, ())
+                if msg_cls not in cls._fast_path_messages
+            )
+
+        # Message classes and visitor functions are resolved now and referenced
+        # directly by the generated code, no method lookup happens per message
+        namespace = {}
+        lines = ['def _dispatch(self, msg):', '    msg_type = type(msg)']
+        case = '    if msg_type is _msg_cls_{0}: return _visit_{0}(self, msg)'
+        for i, msg_cls in enumerate(msg_classes):
+            namespace['_msg_cls_{}'.format(i)] = msg_cls
+            namespace['_visit_{}'.format(i)] = getattr(cls, msg_cls.visit_method_name)
+            lines.append(case.format(i))
+        lines.append('    return msg.accept(self)')
+        exec('\n'.join(lines), namespace)
+        return namespace['_dispatch']
 
     def __init__(
-        self, name: str, env: simpy.Environment, bus: EventBus, connection: Connection
+        self,
+        name: str,
+        env: simpy.Environment,
+        bus: SimEventBus,
+        connection: Connection,
     ):
         self.name = name
         self.env = env
         self.bus = bus
         self.connection = connection
+        if self.is_upstream:
+            self.send_store = connection.incoming
+            self.recv_store = connection.outgoing
+        else:
+            self.send_store = connection.outgoing
+            self.recv_store = connection.incoming
         self.request_registry = RequestRegistry()
         self.receive_loop_process = self.env.process(self.__receive_loop())
 
+    @property
+    def is_bus_enabled(self):
+        """Log messages are formatted and emitted only if somebody listens to them"""
+        return self.bus.has_listeners(self.name)
+
     def terminate(self):
         self.receive_loop_process.interrupt()
 
     def send_request(self, req):
         """Register the request and send it down the line"""
-        self.request_registry.push(req)
-        self._send_msg(req)
+        evicted_req = self.request_registry.push(req)
+        if evicted_req is not None:
+            self._emit_protocol_msg_on_bus(
+                'Unanswered request evicted by request ID {}', evicted_req, req.req_id
+            )
+        self.send_store.put(req)
+
+    def send_requests(self, reqs):
+        """Register and send all requests one after another"""
+        for req in reqs:
+            self.send_request(req)
 
-    @abstractmethod
     def _send_msg(self, msg):
-        pass
+        self.send_store.put(msg)
 
-    @abstractmethod
     def _recv_msg(self):
-        pass
+        return self.recv_store.get()
 
     @abstractmethod
     def _on_invalid_message(self, msg):
         pass
 
     def _emit_aux_msg_on_bus(self, log_msg: str):
-        self.bus.emit(self.name, self.env.now, self.connection.uid, log_msg)
+        if self.is_bus_enabled:
+            self.bus.emit(self.name, self.env.now, self.connection.uid, log_msg)
 
-    def _emit_protocol_msg_on_bus(self, log_msg: str, msg: Message):
-        self._emit_aux_msg_on_bus('{}: {}'.format(log_msg, msg))
+    def _emit_protocol_msg_on_bus(self, log_msg: str, msg: Message, *log_msg_args):
+        """Emits protocol message with a log message on the bus
+
+        :param log_msg: log message or format string of the log message
+        :param log_msg_args: optional arguments for the log message format string,
+        formatting is done only if anybody listens to the bus
+        """
+        if self.is_bus_enabled:
+            if log_msg_args:
+                log_msg = log_msg.format(*log_msg_args)
+            self.bus.emit(
+                self.name,
+                self.env.now,
+                self.connection.uid,
+                '{}: {}'.format(log_msg, msg),
+            )
 
     def __receive_loop(self):
         """Receive process for a particular connection dispatches each received message
@@ -131,11 +294,10 @@ class ConnectionProcessor:
                 self._emit_protocol_msg_on_bus('INCOMING', msg)
 
                 try:
-                    msg.accept(self)
+                    self._dispatch(msg)
                 except Message.VisitorMethodNotImplemented as e:
                     self._emit_protocol_msg_on_bus(
-                        "{} doesn't implement:{}() for".format(type(self).__name_, e),
-                        msg,
+                        "{} doesn't implement:{}() for", msg, type(self).__name__, e
                     )
                 #    self._on_invalid_message(msg)
 
@@ -150,11 +312,9 @@ class UpstreamConnectionProcessor(ConnectionProcessor):
     This class only determines the direction in which it accesses the connection.
     """
 
-    def _send_msg(self, msg):
-        self.connection.incoming.put(msg)
+    __slots__ = ()
 
-    def _recv_msg(self):
-        return self.connection.outgoing.get()
+    is_upstream = True
 
     @abstractmethod
     def _on_invalid_message(self, msg):
@@ -168,11 +328,9 @@ class DownstreamConnectionProcessor(ConnectionProcessor):
     Also, the downstream processor is able to initiate the shutdown of the connection.
     """
 
-    def _send_msg(self, msg):
-        self.connection.outgoing.put(msg)
+    __slots__ = ()
 
-    def _recv_msg(self):
-        return self.connection.incoming.get()
+    is_upstream = False
 
     def disconnect(self):
         """Downstream node may initiate disconnect
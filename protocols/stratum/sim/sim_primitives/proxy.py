@@ -21,20 +21,17 @@
 # contact us at opensource@braiins.com.
 
 """Generic pool module"""
-import hashlib
-
-import numpy as np
 import simpy
-from event_bus import EventBus
 
 import sim_primitives.coins as coins
 from sim_primitives.hashrate_meter import HashrateMeter
 from sim_primitives.protocol import (
     UpstreamConnectionProcessor,
     DownstreamConnectionProcessor,
+    SimEventBus,
 )
 from sim_primitives.network import Connection, AcceptingConnection, ConnectionFactory
-from sim_primitives.pool import MiningSession
+from sim_primitives.pool import JobState, MiningSession
 
 
 class Proxy(AcceptingConnection):
@@ -56,7 +53,7 @@ class Proxy(AcceptingConnection):
         self,
         name: str,
         env: simpy.Environment,
-        bus: EventBus,
+        bus: SimEventBus,
         translation_type: UpstreamConnectionProcessor,
         upstream_connection_factory: ConnectionFactory,
         upstream_node: AcceptingConnection,
@@ -147,17 +144,16 @@ class Proxy(AcceptingConnection):
     def process_submit(
         self, submit_job_uid, session: MiningSession, on_accept, on_reject
     ):
-        if session.job_registry.contains(submit_job_uid):
-            diff_target = session.job_registry.get_job_diff_target(submit_job_uid)
+        job_state, diff_target = session.job_registry.get_job_state_and_diff_target(
+            submit_job_uid
+        )
+        if job_state is JobState.VALID:
             # Global accounting
             self.account_accepted_shares(diff_target)
             # Per session accounting
             session.account_diff_shares(diff_target.to_difficulty())
             on_accept(diff_target)
-        elif session.job_registry.contains_invalid(submit_job_uid):
-            diff_target = session.job_registry.get_invalid_job_diff_target(
-                submit_job_uid
-            )
+        elif job_state is JobState.STALE:
             self.account_stale_shares(diff_target)
             on_reject(diff_target)
         else:
@@ -167,6 +163,8 @@ class Proxy(AcceptingConnection):
     def __pool_speed_meter(self):
         while True:
             yield self.env.timeout(self.meter_period)
+            if not self.bus.has_listeners(self.name):
+                continue
             speed = self.meter_accepted.get_speed()
             submit_speed = self.meter_accepted.get_submit_per_secs()
             if speed is None or submit_speed is None:
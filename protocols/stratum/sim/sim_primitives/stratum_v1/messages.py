@@ -25,59 +25,85 @@ from sim_primitives.protocol import Message
 
 
 class Configure(Message):
+    __slots__ = ('extensions', 'extension_params')
+
     def __init__(self, req_id, extensions, extension_params):
         self.extensions = extensions
         self.extension_params = extension_params
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class ConfigureResponse(Message):
+    __slots__ = ('extensions', 'extension_params')
+
     def __init__(self, req_id, extensions: list, extension_params: dict):
         self.extensions = extensions
         self.extension_params = extension_params
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class Authorize(Message):
+    __slots__ = ('user_name', 'password')
+
     def __init__(self, req_id, user_name, password):
         self.user_name = user_name
         self.password = password
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class Subscribe(Message):
+    __slots__ = ('signature', 'extranonce1', 'url')
+
     def __init__(self, req_id, signature, extranonce1, url):
         self.signature = signature
         self.extranonce1 = extranonce1
         self.url = url
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class SubscribeResponse(Message):
+    __slots__ = ('subscription_ids', 'extranonce1', 'extranonce2_size')
+
     def __init__(self, req_id, subscription_ids, extranonce1, extranonce2_size):
         self.subscription_ids = subscription_ids
         self.extranonce1 = extranonce1
         self.extranonce2_size = extranonce2_size
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class SetDifficulty(Message):
+    __slots__ = ('diff',)
+
     def __init__(self, diff):
         self.diff = diff
-        super().__init__()
+        self.req_id = None
 
 
 class Submit(Message):
+    __slots__ = ('user_name', 'job_id', 'extranonce2', 'time', 'nonce')
+
     def __init__(self, req_id, user_name, job_id, extranonce2, time, nonce):
         self.user_name = user_name
         self.job_id = job_id
         self.extranonce2 = extranonce2
         self.time = time
         self.nonce = nonce
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class Notify(Message):
+    __slots__ = (
+        'job_id',
+        'prev_hash',
+        'coin_base_1',
+        'coin_base_2',
+        'merkle_branch',
+        'version',
+        'bits',
+        'time',
+        'clean_jobs',
+    )
+
     def __init__(
         self,
         job_id,
@@ -99,23 +125,27 @@ class Notify(Message):
         self.bits = bits
         self.time = time
         self.clean_jobs = clean_jobs
-        super().__init__()
+        self.req_id = None
 
 
 class Reconnect(Message):
+    __slots__ = ('hostname', 'port', 'wait_time')
+
     def __init__(self, hostname, port, wait_time):
         self.hostname = hostname
         self.port = port
         self.wait_time = wait_time
-        super().__init__()
+        self.req_id = None
 
 
 class OkResult(Message):
-    pass
+    __slots__ = ()
 
 
 class ErrorResult(Message):
+    __slots__ = ('code', 'msg')
+
     def __init__(self, req_id, code, msg):
         self.code = code
         self.msg = msg
-        super().__init__(req_id)
+        self.req_id = req_id
@@ -40,22 +40,41 @@ from sim_primitives.stratum_v1.messages import (
 
 
 class MinerV1(DownstreamConnectionProcessor):
-    class States(enum.Enum):
+    __slots__ = (
+        'miner',
+        'state',
+        'session',
+        'desired_submits_per_sec',
+        'default_difficulty',
+        '_pop_request',
+        'allowed_to_mine',
+    )
+
+    _fast_path_messages = (Notify, OkResult)
+
+    class States(enum.IntFlag):
         INIT = enum.auto()
         AUTHORIZED = enum.auto()
         AUTHORIZED_AND_SUBSCRIBED = enum.auto()
         SUBSCRIBED = enum.auto()
         RUNNING = enum.auto()
 
+    # States that allow mining on received jobs
+    _MINING_ALLOWED_MASK = int(
+        States.RUNNING | States.AUTHORIZED_AND_SUBSCRIBED | States.SUBSCRIBED
+    )
+
     def __init__(self, miner: Miner, connection: Connection):
         self.miner = miner
-        self.state = self.States.INIT
+        self.__set_state(self.States.INIT)
         self.session = None
         self.desired_submits_per_sec = 0.3
-        self.default_difficulty = self.miner.device_information.get('speed_ghps') / (
+        self.default_difficulty = self.miner.device_spec.speed_ghps / (
             4.294_967_296 * self.desired_submits_per_sec
         )
         super().__init__(miner.name, miner.env, miner.bus, connection)
+        # Bound once, every response looks up its request
+        self._pop_request = self.request_registry.pop
         self.setup()
 
     def setup(self):
@@ -82,37 +101,37 @@ class MinerV1(DownstreamConnectionProcessor):
         self.send_request(submit_req)
 
     def visit_ok_result(self, msg):
-        req = self.request_registry.pop(msg.req_id)
+        req = self._pop_request(msg.req_id)
         if not req:
             self._on_invalid_message(msg)
             return
-        if isinstance(req, Authorize):
+        if type(req) is Authorize:
             if self.state == self.States.INIT:
-                self.state = self.States.AUTHORIZED
+                self.__set_state(self.States.AUTHORIZED)
             elif self.state == self.States.SUBSCRIBED:
-                self.state = self.States.AUTHORIZED_AND_SUBSCRIBED
+                self.__set_state(self.States.AUTHORIZED_AND_SUBSCRIBED)
             self._emit_protocol_msg_on_bus('Connection authorized', msg)
 
     def visit_error_result(self, msg):
-        req = self.request_registry.pop(msg.req_id)
+        req = self._pop_request(msg.req_id)
         if req:
             self._emit_protocol_msg_on_bus(
-                "Error code {}, '{}' for request".format(msg.code, msg.msg), req
+                "Error code {}, '{}' for request", req, msg.code, msg.msg
             )
 
     def visit_subscribe_response(self, msg):
-        if not self.request_registry.pop(msg.req_id):
+        if not self._pop_request(msg.req_id):
             self._on_invalid_message(msg)
             return
         if self.state == self.States.INIT:
-            self.state = self.States.SUBSCRIBED
+            self.__set_state(self.States.SUBSCRIBED)
         elif self.state == self.States.AUTHORIZED:
-            self.state = self.States.AUTHORIZED_AND_SUBSCRIBED
+            self.__set_state(self.States.AUTHORIZED_AND_SUBSCRIBED)
         self._emit_protocol_msg_on_bus('Connection subscribed', msg)
 
     def visit_notify(self, msg):
-        if self._allowed_to_mine:
-            self.state = self.States.RUNNING
+        if self.allowed_to_mine:
+            self.__set_state(self.States.RUNNING)
             job = self.session.new_mining_job(job_uid=msg.job_id)
             self.miner.mine_on_new_job(job, flush_any_pending_work=msg.clean_jobs)
         else:
@@ -124,16 +143,18 @@ class MinerV1(DownstreamConnectionProcessor):
 
     def visit_reconnect(self, msg):
         self._emit_protocol_msg_on_bus(
-            'Reconnect received, waiting {} seconds'.format(msg.wait_time), msg
+            'Reconnect received, waiting {} seconds', msg, msg.wait_time
         )
 
         def disconnect_and_reconnect():
             target = self.connection.conn_target
             self.session.terminate()
-            self.state = self.States.INIT
+            self.__set_state(self.States.INIT)
             self.miner.set_is_mining(False)
             self.connection.disconnect()
             yield self.env.timeout(msg.wait_time)
+            # No response to the requests sent before the disconnect will arrive
+            self.request_registry.clear()
             self.setup()
             self.connection.connect_to(target)
             self.miner.set_is_mining(True)
@@ -141,13 +162,10 @@ class MinerV1(DownstreamConnectionProcessor):
 
         self.env.process(disconnect_and_reconnect())
 
-    @property
-    def _allowed_to_mine(self):
-        return self.state in (
-            self.States.RUNNING,
-            self.States.AUTHORIZED_AND_SUBSCRIBED,
-            self.States.SUBSCRIBED,
-        )
+    def __set_state(self, state):
+        """Switches the state and reevaluates whether mining is allowed in it"""
+        self.state = state
+        self.allowed_to_mine = bool(state & self._MINING_ALLOWED_MASK)
 
     def _on_invalid_message(self, msg):
         self._emit_protocol_msg_on_bus('Received invalid message', msg)
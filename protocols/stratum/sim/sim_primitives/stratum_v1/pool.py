@@ -24,6 +24,7 @@
 Stratum V1 pool implementation
 
 """
+import collections
 import enum
 
 from sim_primitives.pool import MiningSession, Pool
@@ -41,11 +42,16 @@ from sim_primitives.stratum_v1.messages import (
     ConfigureResponse,
 )
 
+# TODO: Extra nonce 1 is 8 bytes long and hardcoded
+EXTRANONCE1 = bytes(8)
+
 
 class MiningSessionV1(MiningSession):
     """V1 specific mining session registers authorize requests """
 
-    class States(enum.Enum):
+    __slots__ = ('state', 'authorize_requests')
+
+    class States(enum.IntEnum):
         """Stratum V1 mining session follows the state machine below."""
 
         INIT = 0
@@ -55,11 +61,17 @@ class MiningSessionV1(MiningSession):
         SUBSCRIBED = 3
         RUNNING = 4
 
+    # States in which mining.subscribe is accepted
+    SUBSCRIBE_ALLOWED_STATES = frozenset((States.INIT, States.AUTHORIZED))
+
+    # Only the most recent authorize requests are kept
+    max_authorize_requests = 32
+
     def __init__(self, *args, **kwargs):
         self.state = self.States.INIT
         super().__init__(*args, **kwargs)
 
-        self.authorize_requests = []
+        self.authorize_requests = collections.deque(maxlen=self.max_authorize_requests)
 
     def run(self):
         """V1 Session switches its state"""
@@ -75,23 +87,18 @@ class PoolV1(UpstreamConnectionProcessor):
 
     """
 
+    __slots__ = ('pool', 'mining_session')
+
+    _fast_path_messages = (Submit,)
+
     def __init__(self, pool: Pool, connection):
         self.pool = pool
-        self.__mining_session = pool.new_mining_session(
+        # The mining session lives as long as the connection processor
+        self.mining_session = pool.new_mining_session(
             connection, self._on_vardiff_change, clz=MiningSessionV1
         )
         super().__init__(pool.name, pool.env, pool.bus, connection)
 
-    @property
-    def mining_session(self):
-        """Accessor for the current mining session cannot fail.
-
-        """
-        assert (
-            self.__mining_session is not None
-        ), 'BUG: V1 Connection processor has no mining session!'
-        return self.__mining_session
-
     def terminate(self):
         super().terminate()
         self.mining_session.terminate()
@@ -111,10 +118,7 @@ class PoolV1(UpstreamConnectionProcessor):
         """
         self.__emit_protocol_msg_on_bus_with_state(msg)
 
-        if self.mining_session.state in (
-            self.mining_session.States.INIT,
-            self.mining_session.States.AUTHORIZED,
-        ):
+        if self.mining_session.state in MiningSessionV1.SUBSCRIBE_ALLOWED_STATES:
             # Subscribe is now complete we can activate a mining session that starts
             # generating new jobs immediately
             self.mining_session.state = self.mining_session.States.SUBSCRIBED
@@ -122,8 +126,7 @@ class PoolV1(UpstreamConnectionProcessor):
                 SubscribeResponse(
                     msg.req_id,
                     subscription_ids=None,
-                    # TODO: Extra nonce 1 is 8 bytes long and hardcoded
-                    extranonce1=bytes([0] * 8),
+                    extranonce1=EXTRANONCE1,
                     extranonce2_size=self.pool.extranonce2_size,
                 )
             )
@@ -135,7 +138,7 @@ class PoolV1(UpstreamConnectionProcessor):
                     msg.req_id,
                     -1,
                     'Subscribe not expected when in: {}'.format(
-                        self.mining_session.state
+                        self.mining_session.state.name
                     ),
                 )
             )
@@ -204,6 +207,8 @@ class PoolV1(UpstreamConnectionProcessor):
 
     def __emit_protocol_msg_on_bus_with_state(self, msg):
         """Common protocol message logging decorated with mining session state"""
-        self._emit_protocol_msg_on_bus(
-            '{}(state={})'.format(type(msg).__name__, self.mining_session.state), msg
-        )
+        # Message type name and state are only resolved when there is a consumer
+        if self.is_bus_enabled:
+            self._emit_protocol_msg_on_bus(
+                '{}(state={})', msg, type(msg).__name__, self.mining_session.state.name,
+            )
@@ -20,33 +20,67 @@
 # of such proprietary license or if you have any other questions, please
 # contact us at opensource@braiins.com.
 
+"""Stratum V2 messages."""
+from __future__ import annotations
+
+import functools
+import operator
+import sys
 import typing
 
-"""Stratum V2 messages."""
 from sim_primitives.protocol import Message
 from sim_primitives.stratum_v2.types import (
     Hash,
     MerklePath,
     CoinBasePrefix,
     CoinBaseSuffix,
+    DownstreamConnectionFlags,
+    UpstreamConnectionFlags,
 )
 
 
+def _flags_to_bits(flags, flags_type):
+    """Combines individual connection flags into a single bit mask of flags_type
+
+    An already combined mask (or a plain int) is passed through without iterating.
+    """
+    if isinstance(flags, flags_type):
+        return flags
+    if isinstance(flags, int):
+        return flags_type(flags)
+    return functools.reduce(operator.or_, flags, flags_type(0))
+
+
 class ChannelMessage(Message):
     """Message specific for a channel identified by its channel_id"""
 
-    def __init__(self, channel_id: int, *args, **kwargs):
+    __slots__ = ('channel_id',)
+
+    def __init__(self, channel_id: int, req_id=None):
         self.channel_id = channel_id
-        super().__init__(*args, **kwargs)
+        self.req_id = req_id
 
 
 class SetupConnection(Message):
+    __slots__ = (
+        'protocol',
+        'max_version',
+        'min_version',
+        'flags',
+        'endpoint_host',
+        'endpoint_port',
+        'vendor',
+        'hardware_version',
+        'firmware',
+        'device_id',
+    )
+
     def __init__(
         self,
         protocol: int,
         max_version: int,
         min_version: int,
-        flags: set,
+        flags: typing.Union[DownstreamConnectionFlags, typing.Iterable],
         endpoint_host: str,
         endpoint_port: int,
         vendor: str,
@@ -57,33 +91,47 @@ class SetupConnection(Message):
         self.protocol = protocol
         self.max_version = max_version
         self.min_version = min_version
-        self.flags = set(flags)
+        self.flags = _flags_to_bits(flags, DownstreamConnectionFlags)
         self.endpoint_host = endpoint_host
         self.endpoint_port = endpoint_port
-        # Device information
-        self.vendor = vendor
-        self.hardware_version = hardware_version
-        self.firmware = firmware
+        # Device information, identical models of simulated devices share the strings
+        self.vendor = sys.intern(vendor)
+        self.hardware_version = sys.intern(hardware_version)
+        self.firmware = sys.intern(firmware)
         self.device_id = device_id
-        super().__init__()
+        self.req_id = None
 
 
 class SetupConnectionSuccess(Message):
-    def __init__(self, used_version: int, flags: set):
+    __slots__ = ('used_version', 'flags')
+
+    def __init__(
+        self,
+        used_version: int,
+        flags: typing.Union[UpstreamConnectionFlags, typing.Iterable],
+    ):
         self.used_version = used_version
-        self.flags = set(flags)
-        super().__init__()
+        self.flags = _flags_to_bits(flags, UpstreamConnectionFlags)
+        self.req_id = None
 
 
 class SetupConnectionError(Message):
-    def __init__(self, flags: list, error_code: str):
-        self.flags = flags
+    __slots__ = ('flags', 'error_code')
+
+    def __init__(
+        self,
+        flags: typing.Union[DownstreamConnectionFlags, typing.Iterable],
+        error_code: str,
+    ):
+        self.flags = _flags_to_bits(flags, DownstreamConnectionFlags)
         self.error_code = error_code
-        super().__init__()
+        self.req_id = None
 
 
 # Mining Protocol Messages
 class OpenStandardMiningChannel(Message):
+    __slots__ = ('user_identity', 'nominal_hashrate', 'max_target', 'new_job_class')
+
     def __init__(
         self,
         req_id: typing.Any,
@@ -97,10 +145,12 @@ class OpenStandardMiningChannel(Message):
         self.nominal_hashrate = nominal_hashrate
         self.max_target = max_target
         self.new_job_class = NewMiningJob
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class OpenStandardMiningChannelSuccess(ChannelMessage):
+    __slots__ = ('target', 'group_channel_id', 'extranonce_prefix')
+
     def __init__(
         self,
         req_id: typing.Any,
@@ -110,19 +160,34 @@ class OpenStandardMiningChannelSuccess(ChannelMessage):
         group_channel_id: int,
     ):
         self.target = target
-        self.group_channel_id = group_channel_id
         self.extranonce_prefix = extranonce_prefix
-        super().__init__(channel_id=channel_id, req_id=req_id)
+        self.group_channel_id = group_channel_id
+        self.channel_id = channel_id
+        self.req_id = req_id
 
 
 class OpenExtendedMiningChannel(OpenStandardMiningChannel):
-    def __init__(self, min_extranonce_size: int, *args, **kwargs):
+    __slots__ = ('min_extranonce_size',)
+
+    def __init__(
+        self,
+        min_extranonce_size: int,
+        req_id: typing.Any,
+        user_identity: str,
+        nominal_hashrate: float,
+        max_target: int,
+    ):
+        self.user_identity = user_identity
+        self.nominal_hashrate = nominal_hashrate
+        self.max_target = max_target
         self.min_extranonce_size = min_extranonce_size
         self.new_job_class = NewExtendedMiningJob
-        super().__init__(*args, **kwargs)
+        self.req_id = req_id
 
 
 class OpenExtendedMiningChannelSuccess(ChannelMessage):
+    __slots__ = ('target', 'extranonce_prefix', 'extranonce_size')
+
     def __init__(
         self,
         req_id,
@@ -132,44 +197,67 @@ class OpenExtendedMiningChannelSuccess(ChannelMessage):
         extranonce_prefix: bytes,
     ):
         self.target = target
-        self.extranonce_prefix = extranonce_prefix
         self.extranonce_size = extranonce_size
-        super().__init__(channel_id=channel_id, req_id=req_id)
+        self.extranonce_prefix = extranonce_prefix
+        self.channel_id = channel_id
+        self.req_id = req_id
 
 
 class OpenMiningChannelError(Message):
+    __slots__ = ('error_code',)
+
     def __init__(self, req_id, error_code: str):
-        self.req_id = req_id
         self.error_code = error_code
-        super().__init__(req_id)
+        self.req_id = req_id
 
 
 class UpdateChannel(ChannelMessage):
+    __slots__ = ('nominal_hash_rate', 'maximum_target')
+
     def __init__(self, channel_id: int, nominal_hash_rate: float, maximum_target: int):
         self.nominal_hash_rate = nominal_hash_rate
         self.maximum_target = maximum_target
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class UpdateChannelError(ChannelMessage):
+    __slots__ = ('error_code',)
+
     def __init__(self, channel_id: int, error_code: str):
         self.error_code = error_code
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class CloseChannel(ChannelMessage):
+    __slots__ = ('reason_code',)
+
     def __init__(self, channel_id: int, reason_code: str):
         self.reason_code = reason_code
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SetExtranoncePrefix(ChannelMessage):
+    __slots__ = ('extranonce_prefix',)
+
     def __init__(self, channel_id: int, extranonce_prefix: bytes):
         self.extranonce_prefix = extranonce_prefix
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SubmitSharesStandard(ChannelMessage):
+    __slots__ = (
+        'sequence_number',
+        'job_id',
+        'nonce',
+        'ntime',
+        'version',
+        '_str_cache',
+    )
+
     def __init__(
         self,
         channel_id: int,
@@ -184,21 +272,52 @@ class SubmitSharesStandard(ChannelMessage):
         self.nonce = nonce
         self.ntime = ntime
         self.version = version
-        super().__init__(channel_id)
+        self.channel_id = channel_id
+        self._str_cache = None
+        self.req_id = None
+
+    _STR_FMT = 'channel_id=%s, job_id=%s'
 
     def __str__(self):
-        return self._format(
-            'channel_id={}, job_id={}'.format(self.channel_id, self.job_id)
-        )
+        if self._str_cache is None:
+            self._str_cache = self._format(
+                self._STR_FMT % (self.channel_id, self.job_id)
+            )
+        return self._str_cache
 
 
 class SubmitSharesExtended(SubmitSharesStandard):
-    def __init__(self, extranonce, *args, **kwargs):
+    __slots__ = ('extranonce',)
+
+    def __init__(
+        self,
+        extranonce,
+        channel_id: int,
+        sequence_number: int,
+        job_id: int,
+        nonce: int,
+        ntime: int,
+        version: int,
+    ):
         self.extranonce = extranonce
-        super().__init__(*args, **kwargs)
+        self.sequence_number = sequence_number
+        self.job_id = job_id
+        self.nonce = nonce
+        self.ntime = ntime
+        self.version = version
+        self.channel_id = channel_id
+        self._str_cache = None
+        self.req_id = None
 
 
 class SubmitSharesSuccess(ChannelMessage):
+    __slots__ = (
+        'last_sequence_number',
+        'new_submits_accepted_count',
+        'new_shares_sum',
+        '_str_cache',
+    )
+
     def __init__(
         self,
         channel_id: int,
@@ -209,27 +328,39 @@ class SubmitSharesSuccess(ChannelMessage):
         self.last_sequence_number = last_sequence_number
         self.new_submits_accepted_count = new_submits_accepted_count
         self.new_shares_sum = new_shares_sum
-        super().__init__(channel_id)
+        self.channel_id = channel_id
+        self._str_cache = None
+        self.req_id = None
+
+    _STR_FMT = 'channel_id=%s, last_seq_num=%s, accepted_submits=%s, accepted_shares=%s'
 
     def __str__(self):
-        return self._format(
-            'channel_id={}, last_seq_num={}, accepted_submits={}, accepted_shares={}'.format(
-                self.channel_id,
-                self.last_sequence_number,
-                self.new_submits_accepted_count,
-                self.new_shares_sum,
+        if self._str_cache is None:
+            self._str_cache = self._format(
+                self._STR_FMT
+                % (
+                    self.channel_id,
+                    self.last_sequence_number,
+                    self.new_submits_accepted_count,
+                    self.new_shares_sum,
+                )
             )
-        )
+        return self._str_cache
 
 
 class SubmitSharesError(ChannelMessage):
+    __slots__ = ('sequence_number', 'error_code')
+
     def __init__(self, channel_id: int, sequence_number: int, error_code: str):
         self.sequence_number = sequence_number
         self.error_code = error_code
-        super().__init__(channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class NewMiningJob(ChannelMessage):
+    __slots__ = ('job_id', 'future_job', 'version', 'merkle_root', '_str_cache')
+
     def __init__(
         self,
         channel_id: int,
@@ -242,17 +373,31 @@ class NewMiningJob(ChannelMessage):
         self.future_job = future_job
         self.version = version
         self.merkle_root = merkle_root
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self._str_cache = None
+        self.req_id = None
+
+    _STR_FMT = 'channel_id=%s, job_id=%s, future_job=%s'
 
     def __str__(self):
-        return self._format(
-            'channel_id={}, job_id={}, future_job={}'.format(
-                self.channel_id, self.job_id, self.future_job
+        if self._str_cache is None:
+            self._str_cache = self._format(
+                self._STR_FMT % (self.channel_id, self.job_id, self.future_job)
             )
-        )
+        return self._str_cache
 
 
 class NewExtendedMiningJob(ChannelMessage):
+    __slots__ = (
+        'job_id',
+        'future_job',
+        'version',
+        'version_rolling_allowed',
+        'merkle_path',
+        'cb_prefix',
+        'cb_suffix',
+    )
+
     def __init__(
         self,
         channel_id: int,
@@ -271,26 +416,53 @@ class NewExtendedMiningJob(ChannelMessage):
         self.merkle_path = merkle_path
         self.cb_prefix = cb_prefix
         self.cb_suffix = cb_suffix
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SetNewPrevHash(ChannelMessage):
+    __slots__ = ('prev_hash', 'min_ntime', 'nbits', 'job_id', '_str_cache')
+
     def __init__(
         self, channel_id: int, job_id: int, prev_hash: Hash, min_ntime: int, nbits: int
     ):
+        self.job_id = job_id
         self.prev_hash = prev_hash
         self.min_ntime = min_ntime
         self.nbits = nbits
-        self.job_id = job_id
-        super().__init__(channel_id)
+        self.channel_id = channel_id
+        self._str_cache = None
+        self.req_id = None
+
+    _STR_FMT = 'channel_id=%s, job_id=%s'
 
     def __str__(self):
-        return self._format(
-            'channel_id={}, job_id={}'.format(self.channel_id, self.job_id)
-        )
+        if self._str_cache is None:
+            self._str_cache = self._format(
+                self._STR_FMT % (self.channel_id, self.job_id)
+            )
+        return self._str_cache
 
 
 class SetCustomMiningJob(ChannelMessage):
+    __slots__ = (
+        'request_id',
+        'mining_job_token',
+        'version',
+        'prev_hash',
+        'min_ntime',
+        'nbits',
+        'coinbase_tx_version',
+        'coinbase_prefix',
+        'coinbase_tx_input_nsequence',
+        'coinbase_tx_value_remaining',
+        'coinbase_tx_output',
+        'coinbase_tx_locktime',
+        'merkle_path',
+        'extranonce_size',
+        'future_job',
+    )
+
     def __init__(
         self,
         channel_id: int,
@@ -325,10 +497,13 @@ class SetCustomMiningJob(ChannelMessage):
         self.merkle_path = merkle_path
         self.extranonce_size = extranonce_size
         self.future_job = future_job
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SetCustomMiningJobSuccess(ChannelMessage):
+    __slots__ = ('request_id', 'job_id', 'coinbase_tx_prefix', 'coinbase_tx_suffix')
+
     def __init__(
         self,
         channel_id: int,
@@ -341,31 +516,42 @@ class SetCustomMiningJobSuccess(ChannelMessage):
         self.job_id = job_id
         self.coinbase_tx_prefix = coinbase_tx_prefix
         self.coinbase_tx_suffix = coinbase_tx_suffix
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SetCustomMiningJobError(ChannelMessage):
+    __slots__ = ('request_id', 'error_code')
+
     def __init__(self, channel_id: int, request_id: int, error_code: str):
         self.request_id = request_id
         self.error_code = error_code
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class SetTarget(ChannelMessage):
+    __slots__ = ('max_target',)
+
     def __init__(self, channel_id: int, max_target: int):
         self.max_target = max_target
-        super().__init__(channel_id=channel_id)
+        self.channel_id = channel_id
+        self.req_id = None
 
 
 class Reconnect(Message):
+    __slots__ = ('new_host', 'new_port')
+
     def __init__(self, new_host: str, new_port: int):
         self.new_host = new_host
         self.new_port = new_port
-        super().__init__()
+        self.req_id = None
 
 
 class SetGroupChannel(Message):
+    __slots__ = ('group_channel_id', 'channel_ids')
+
     def __init__(self, group_channel_id: int, channel_ids: typing.List):
         self.group_channel_id = group_channel_id
         self.channel_ids = channel_ids
-        super().__init__()
+        self.req_id = None
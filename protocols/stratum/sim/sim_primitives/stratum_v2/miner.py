@@ -23,6 +23,7 @@
 """V2 header only miner"""
 
 import enum
+import itertools
 
 import sim_primitives.coins as coins
 from sim_primitives.miner import Miner
@@ -49,57 +50,76 @@ from sim_primitives.stratum_v2.types import ProtocolType, DownstreamConnectionFl
 
 # TODO: Move MiningChannel and session from Pool
 
+# TODO-DOC: specification should categorize downstream and upstream flags.
+#  PubKey handling is also not precisely defined yet
+SETUP_CONNECTION_FLAGS = DownstreamConnectionFlags.REQUIRES_STANDARD_JOBS
 
-class MinerV2(DownstreamConnectionProcessor):
-    class ConnectionConfig:
-        """Stratum V2 connection configuration.
 
-        For now, it is sufficient to record the SetupConnectionSuccess to have full
-        connection configuration available.
-        """
+class ConnectionConfig:
+    """Stratum V2 connection configuration.
+
+    For now, it is sufficient to record the SetupConnectionSuccess to have full
+    connection configuration available.
+    """
+
+    __slots__ = ('setup_msg',)
 
-        def __init__(self, msg: SetupConnectionSuccess):
-            self.setup_msg = msg
+    def __init__(self, msg: SetupConnectionSuccess):
+        self.setup_msg = msg
 
-    class States(enum.Enum):
-        INIT = 0
-        CONNECTION_SETUP = 1
+
+class States(enum.IntEnum):
+    """V2 miner connection states"""
+
+    INIT = 0
+    CONNECTION_SETUP = 1
+
+
+class MinerV2(DownstreamConnectionProcessor):
+    __slots__ = (
+        'miner',
+        'state',
+        'channel',
+        'connection_config',
+        'submit_mining_solution',
+    )
+
+    _fast_path_messages = (NewMiningJob, SubmitSharesSuccess)
 
     def __init__(self, miner: Miner, connection: Connection):
         self.miner = miner
-        self.state = self.States.INIT
+        self.state = States.INIT
         self.channel = None
+        # Callback for the physical miner, it is built once the channel is open
+        self.submit_mining_solution = None
         super().__init__(miner.name, miner.env, miner.bus, connection)
+        device_spec = miner.device_spec
         # Initiate V2 protocol setup
-        # TODO-DOC: specification should categorize downstream and upstream flags.
-        #  PubKey handling is also not precisely defined yet
         self._send_msg(
             SetupConnection(
                 protocol=ProtocolType.MINING_PROTOCOL,
                 max_version=2,
                 min_version=2,
-                flags={DownstreamConnectionFlags.REQUIRES_STANDARD_JOBS},  # TODO:
+                flags=SETUP_CONNECTION_FLAGS,
                 endpoint_host=connection.conn_target.name,
                 endpoint_port=connection.port,
-                vendor=self.miner.device_information.get('vendor', 'unknown'),
-                hardware_version=self.miner.device_information.get(
-                    'hardware_version', 'unknown'
-                ),
-                firmware=self.miner.device_information.get('firmware', 'unknown'),
-                device_id=self.miner.device_information.get('device_id', ''),
+                vendor=device_spec.vendor,
+                hardware_version=device_spec.hardware_version,
+                firmware=device_spec.firmware,
+                device_id=device_spec.device_id,
             )
         )
         self.connection_config = None
 
     def visit_setup_connection_success(self, msg: SetupConnectionSuccess):
         self._emit_protocol_msg_on_bus('Connection setup', msg)
-        self.connection_config = self.ConnectionConfig(msg)
-        self.state = self.States.CONNECTION_SETUP
+        self.connection_config = ConnectionConfig(msg)
+        self.state = States.CONNECTION_SETUP
 
         req = OpenStandardMiningChannel(
             req_id=None,
             user_identity=self.name,
-            nominal_hashrate=self.miner.device_information.get('speed_ghps') * 1e9,
+            nominal_hashrate=self.miner.device_spec.speed_ghps * 1e9,
             max_target=self.miner.diff_1_target,
             # Header only mining, now extranonce 2 size required
         )
@@ -132,21 +152,19 @@ class MinerV2(DownstreamConnectionProcessor):
                 conn_uid=self.connection.uid,
                 channel_id=msg.channel_id,
             )
+            self.submit_mining_solution = self.__build_submit_mining_solution(
+                msg.channel_id
+            )
             session.run()
         else:
             self._emit_protocol_msg_on_bus(
                 'Cannot find matching OpenMiningChannel request', msg
             )
 
-    def visit_open_extended_mining_channel_success(
-        self, msg: OpenStandardMiningChannelSuccess
-    ):
-        pass
-
     def visit_open_mining_channel_error(self, msg: OpenMiningChannelError):
         req = self.request_registry.pop(msg.req_id)
         self._emit_protocol_msg_on_bus(
-            'Open mining channel failed (orig request: {})'.format(req), msg
+            'Open mining channel failed (orig request: {})', msg, req
         )
 
     def visit_set_target(self, msg: SetTarget):
@@ -155,11 +173,10 @@ class MinerV2(DownstreamConnectionProcessor):
 
     def visit_set_new_prev_hash(self, msg: SetNewPrevHash):
         if self.__is_channel_valid(msg):
-            if self.channel.session.job_registry.contains(msg.job_id):
-                self.miner.mine_on_new_job(
-                    job=self.channel.session.job_registry.get_job(msg.job_id),
-                    flush_any_pending_work=True,
-                )
+            # A single registry lookup, the registry stores no None jobs
+            job = self.channel.session.job_registry.get_job(msg.job_id)
+            if job is not None:
+                self.miner.mine_on_new_job(job=job, flush_any_pending_work=True)
 
     def visit_new_mining_job(self, msg: NewMiningJob):
         if self.__is_channel_valid(msg):
@@ -179,46 +196,61 @@ class MinerV2(DownstreamConnectionProcessor):
             pass
             # self.channel.session.account_rejected_shares(msg.new_shares_sum)
 
-    def submit_mining_solution(self, job: MiningJob):
-        """Callback from the physical miner that succesfully simulated mining some shares
+    def __build_submit_mining_solution(self, channel_id):
+        """Builds the submit callback specialized for the open channel
 
-        :param job: Job that the miner has been working on and found solution for it
+        The channel ID and everything needed for sending are bound to the closure
+        so that the per share path doesn't have to look them up.
         """
-        # TODO: seq_num is currently unused, we should use it for tracking
-        #  accepted/rejected shares
-        self._send_msg(
-            SubmitSharesStandard(
-                channel_id=self.channel.id,
-                sequence_number=0,  # unique sequential identifier within the channel.
-                job_id=job.uid,
-                nonce=0,
-                ntime=self.env.now,
-                version=0,  # full nVersion field
+        send_msg = self._send_msg
+        env = self.env
+        sequence_numbers = itertools.count()
+
+        def submit_mining_solution(job: MiningJob):
+            """Callback from the physical miner that succesfully simulated mining some
+            shares
+
+            :param job: Job that the miner has been working on and found solution for it
+            """
+            # TODO: seq_num is not used for tracking accepted/rejected shares yet
+            send_msg(
+                SubmitSharesStandard(
+                    channel_id=channel_id,
+                    # unique sequential identifier within the channel
+                    sequence_number=next(sequence_numbers),
+                    job_id=job.uid,
+                    nonce=0,
+                    ntime=env.now,
+                    version=0,  # full nVersion field
+                )
             )
-        )
+
+        return submit_mining_solution
 
     def _on_invalid_message(self, msg):
         self._emit_protocol_msg_on_bus('Received invalid message', msg)
 
     def __is_channel_valid(self, msg):
-        """Validates channel referenced in the message is the open channel of the miner"""
-        if self.channel is None:
-            bus_error_msg = (
+        """Validates channel referenced in the message is the open channel of the miner
+
+        Only an invalid channel is reported, the log message is formatted only if
+        anybody listens to the bus.
+        """
+        channel = self.channel
+        if channel is not None and channel.id == msg.channel_id:
+            return True
+        if channel is None:
+            self._emit_protocol_msg_on_bus(
                 'Mining Channel not established yet, received channel '
-                'message with channel ID({})'.format(msg.channel_id)
+                'message with channel ID({})',
+                msg,
+                msg.channel_id,
             )
-            is_valid = False
-            self._emit_protocol_msg_on_bus(bus_error_msg, msg)
-        elif self.channel.id != msg.channel_id:
-            bus_error_msg = 'Unknown channel (expected: {}, actual: {})'.format(
-                self.channel.channel_id, msg.channel_id
-            )
-            is_valid = False
-            self._emit_protocol_msg_on_bus(bus_error_msg, msg)
         else:
-            is_valid = True
-
-        return is_valid
-
-    def run(self):
-        pass
+            self._emit_protocol_msg_on_bus(
+                'Unknown channel (expected: {}, actual: {})',
+                msg,
+                channel.id,
+                msg.channel_id,
+            )
+        return False
@@ -23,6 +23,9 @@
 """Stratum V2 pool implementation
 
 """
+import collections
+import functools
+
 import sim_primitives.coins as coins
 from sim_primitives.pool import MiningSession, Pool
 from sim_primitives.protocol import UpstreamConnectionProcessor
@@ -34,6 +37,8 @@ from sim_primitives.stratum_v2.types import (
 
 
 class MiningChannel:
+    __slots__ = ('cfg', 'conn_uid', 'id')
+
     def __init__(self, cfg, conn_uid, channel_id):
         """
         :param cfg: configuration is represented by the full OpenStandardMiningChannel or
@@ -50,17 +55,26 @@ class MiningChannel:
 
 
 class PoolMiningChannel(MiningChannel):
-    """This mining channel contains mining session and future job.
+    """This mining channel contains mining session and future jobs.
 
-    Currently, the channel holds only 1 future job.
+    Future jobs are queued in the order they have been sent downstream. Currently,
+    the pool keeps only 1 future job per channel, the queue is a ring of
+    max_future_jobs that drops the oldest future job when full.
     """
 
+    __slots__ = ('future_jobs', 'session', 'job_msg_builder')
+
+    max_future_jobs = 2
+
     def __init__(self, session, *args, **kwargs):
         """
         :param session: optional mining session process (TODO: review if this is the right place)
         """
-        self.future_job = None
+        self.future_jobs = collections.deque(maxlen=self.max_future_jobs)
         self.session = session
+        # Builds job messages of the channel type, it is assigned when the pool
+        # opens the channel
+        self.job_msg_builder = None
         super().__init__(*args, **kwargs)
 
     def terminate(self):
@@ -70,40 +84,40 @@ class PoolMiningChannel(MiningChannel):
         self.session = session
 
     def take_future_job(self):
-        """Takes future job from the channel."""
+        """Takes the oldest future job from the channel."""
         assert (
-            self.future_job is not None
+            self.future_jobs
         ), 'BUG: Attempt to take a future job from channel: {}'.format(self.id)
-        future_job = self.future_job
-        self.future_job = None
-        return future_job
+        return self.future_jobs.popleft()
 
     def add_future_job(self, job):
         """Stores future job ready for mining should a new block be found"""
-        assert (
-            self.future_job is None
-        ), 'BUG: Attempt to overwrite an existing future job: {}'.format(self.id)
-        self.future_job = job
+        self.future_jobs.append(job)
 
 
 class ChannelRegistry:
     """Keeps track of channels on individual connection"""
 
+    __slots__ = ('conn_uid', 'channels', 'next_channel_id')
+
     def __init__(self, conn_uid):
         self.conn_uid = conn_uid
-        self.channels = []
+        # Channels indexed by their ID
+        self.channels = dict()
+        self.next_channel_id = 0
 
     def append(self, channel):
         """Simplify registering new channels"""
-        new_channel_id = len(self.channels)
+        new_channel_id = self.next_channel_id
+        self.next_channel_id += 1
         channel.set_id(new_channel_id)
-        self.channels.append(channel)
+        self.channels[new_channel_id] = channel
 
     def get_channel(self, channel_id):
-        if channel_id < len(self.channels):
-            return self.channels[channel_id]
-        else:
-            return None
+        """
+        :return: the channel or None when no such channel is registered
+        """
+        return self.channels.get(channel_id)
 
 
 class ConnectionConfig:
@@ -112,30 +126,189 @@ class ConnectionConfig:
     For now, it is sufficient to record the SetupConnection to have full connection configuration available.
     """
 
+    __slots__ = ('setup_msg',)
+
     def __init__(self, msg: SetupConnection):
         self.setup_msg = msg
 
     @property
     def requires_version_rolling(self):
-        return (
-            DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING in self.setup_msg.flags
+        return bool(
+            self.setup_msg.flags & DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING
         )
 
 
+class PendingSharesAck:
+    """Accepted shares of a channel that haven't been acknowledged yet"""
+
+    __slots__ = ('last_sequence_number', 'accepted_count', 'shares_sum')
+
+    def __init__(self, last_sequence_number, shares):
+        self.last_sequence_number = last_sequence_number
+        self.accepted_count = 1
+        self.shares_sum = shares
+
+
+class SharesAckAggregator:
+    """Acknowledges accepted shares of channels by SubmitSharesSuccess messages
+
+    Without a delay, each accepted share is acknowledged right away. With a delay,
+    the shares of a channel are acknowledged by a single SubmitSharesSuccess for all
+    shares accepted within the delay or once max_pending_acks shares are pending.
+    Note, that the delay postpones the share accounting of the downstream node.
+    """
+
+    __slots__ = ('env', 'send_msg', 'delay', 'max_pending_acks', 'pending_acks')
+
+    def __init__(self, env, send_msg, delay=None, max_pending_acks=32):
+        """
+        :param send_msg: callback that sends the SubmitSharesSuccess message
+        :param delay: time in seconds for aggregating the acknowledgements, None
+        disables the aggregation
+        :param max_pending_acks: number of accepted shares that are acknowledged
+        immediately regardless of the delay
+        """
+        self.env = env
+        self.send_msg = send_msg
+        self.delay = delay
+        self.max_pending_acks = max_pending_acks
+        # Aggregated acknowledgements of accepted shares indexed by channel ID
+        self.pending_acks = dict()
+
+    def ack_accepted_share(self, channel_id, sequence_number, shares):
+        """Adds an accepted share to the pending acknowledgement of the channel
+
+        The first pending share schedules sending the acknowledgement.
+        """
+        if self.delay is None:
+            self.send_msg(SubmitSharesSuccess(channel_id, sequence_number, 1, shares))
+            return
+        ack = self.pending_acks.get(channel_id)
+        if ack is None:
+            ack = PendingSharesAck(sequence_number, shares)
+            self.pending_acks[channel_id] = ack
+            self.env.timeout(self.delay).callbacks.append(
+                functools.partial(self.__on_timeout, channel_id, ack)
+            )
+        else:
+            ack.last_sequence_number = sequence_number
+            ack.accepted_count += 1
+            ack.shares_sum += shares
+        if ack.accepted_count >= self.max_pending_acks:
+            self.flush(channel_id)
+
+    def __on_timeout(self, channel_id, ack: PendingSharesAck, _event):
+        # The acknowledgement may have been flushed already and a new one started
+        if self.pending_acks.get(channel_id) is ack:
+            self.flush(channel_id)
+
+    def flush(self, channel_id):
+        """Sends the pending acknowledgement of accepted shares of the channel"""
+        ack = self.pending_acks.pop(channel_id, None)
+        if ack is not None:
+            self.send_msg(
+                SubmitSharesSuccess(
+                    channel_id,
+                    ack.last_sequence_number,
+                    ack.accepted_count,
+                    ack.shares_sum,
+                )
+            )
+
+    def flush_all(self):
+        """Sends the pending acknowledgements of all channels"""
+        for channel_id in list(self.pending_acks):
+            self.flush(channel_id)
+
+
+# Job placeholders carry no data in the simulation, all job messages share them
+_EMPTY_HASH = Hash()
+_EMPTY_MERKLE_PATH = MerklePath()
+_EMPTY_CB_PREFIX = CoinBasePrefix()
+_EMPTY_CB_SUFFIX = CoinBaseSuffix()
+
+# Error codes of SubmitSharesError
+SHARE_REJECTED_ERROR_CODE = 'Share rejected'
+INVALID_CHANNEL_ID_ERROR_CODE = 'invalid-channel-id'
+
+
+def _build_new_mining_job_msg(
+    mining_channel: PoolMiningChannel, new_job, is_future_job: bool
+):
+    """Job message builder for standard channels"""
+    # Positional arguments: channel_id, job_id, future_job, version, merkle_root
+    return NewMiningJob(
+        mining_channel.id, new_job.uid, is_future_job, None, _EMPTY_HASH
+    )
+
+
+def _build_new_extended_mining_job_msg(
+    mining_channel: PoolMiningChannel, new_job, is_future_job: bool
+):
+    """Job message builder for extended channels"""
+    # Positional arguments: channel_id, job_id, future_job, version,
+    # version_rolling_allowed, merkle_path, cb_prefix, cb_suffix
+    return NewExtendedMiningJob(
+        mining_channel.id,
+        new_job.uid,
+        is_future_job,
+        None,
+        True,  # TODO
+        _EMPTY_MERKLE_PATH,
+        _EMPTY_CB_PREFIX,
+        _EMPTY_CB_SUFFIX,
+    )
+
+
+# Job message builders indexed by the type of message that has opened the channel
+JOB_MSG_BUILDERS = {
+    OpenStandardMiningChannel: _build_new_mining_job_msg,
+    OpenExtendedMiningChannel: _build_new_extended_mining_job_msg,
+}
+
+
 class PoolV2(UpstreamConnectionProcessor):
     """Processes all messages on 1 connection
 
+    Accepted shares are acknowledged as described in SharesAckAggregator.
     """
 
-    def __init__(self, pool: Pool, connection):
+    __slots__ = (
+        'pool',
+        '_diff_1_target',
+        'connection_config',
+        '_shares_ack',
+        '_mining_channel_registry',
+    )
+
+    _fast_path_messages = (SubmitSharesStandard,)
+
+    def __init__(
+        self, pool: Pool, connection, submit_ack_delay=None, max_pending_acks=32
+    ):
+        """
+        :param submit_ack_delay: time in seconds for aggregating acknowledgements of
+        accepted shares, see SharesAckAggregator. None acknowledges each share
+        immediately
+        :param max_pending_acks: number of accepted shares that are acknowledged
+        immediately regardless of submit_ack_delay
+        """
         self.pool = pool
+        # The network difficulty 1 target is fixed for the whole simulation
+        self._diff_1_target = pool.default_target.diff_1_target
         self.connection_config = None
+        self._shares_ack = SharesAckAggregator(
+            pool.env, self.__send_submit_ack, submit_ack_delay, max_pending_acks
+        )
         self._mining_channel_registry = ChannelRegistry(connection.uid)
         super().__init__(pool.name, pool.env, pool.bus, connection)
 
     def terminate(self):
+        # Accepted shares are acknowledged before the connection goes down
+        self._shares_ack.flush_all()
         super().terminate()
-        for channel in self._mining_channel_registry.channels:
+        # Snapshot the channels as terminating them may alter the registry
+        for channel in list(self._mining_channel_registry.channels.values()):
             channel.terminate()
 
     def _on_invalid_message(self, msg):
@@ -147,11 +320,11 @@ class PoolV2(UpstreamConnectionProcessor):
 
     def visit_setup_connection(self, msg: SetupConnection):
 
-        response_flags = set()
+        response_flags = UpstreamConnectionFlags(0)
 
         # arbitrary for now
-        if DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING not in msg.flags:
-            response_flags.add(UpstreamConnectionFlags.REQUIRES_FIXED_VERSION)
+        if not msg.flags & DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING:
+            response_flags |= UpstreamConnectionFlags.REQUIRES_FIXED_VERSION
 
         if self.connection_config is None:
             self.connection_config = ConnectionConfig(msg)
@@ -163,11 +336,15 @@ class PoolV2(UpstreamConnectionProcessor):
                 )
             )
         else:
-            self._send_msg(SetupConnectionError('Connection can only be setup once'))
+            self._send_msg(
+                SetupConnectionError(
+                    DownstreamConnectionFlags(0), 'Connection can only be setup once'
+                )
+            )
 
     def visit_open_standard_mining_channel(self, msg: OpenStandardMiningChannel):
         # Open only channels compatible with this node's configuration
-        if msg.max_target <= self.pool.default_target.diff_1_target:
+        if self.__can_open_channel(msg):
             # Create the channel and build back-links from session to channel and from
             # channel to connection
             mining_channel = PoolMiningChannel(
@@ -175,6 +352,7 @@ class PoolV2(UpstreamConnectionProcessor):
             )
             # Appending assigns the channel a unique ID within this connection
             self._mining_channel_registry.append(mining_channel)
+            mining_channel.job_msg_builder = JOB_MSG_BUILDERS[type(msg)]
 
             # TODO use partial to bind the mining channel to the _on_vardiff_change and eliminate the need for the
             #  backlink
@@ -199,17 +377,17 @@ class PoolV2(UpstreamConnectionProcessor):
             #  Update the flow diagram in the spec including specifying the
             #  future_job attribute
             new_job_msg = self.__build_new_job_msg(mining_channel, is_future_job=True)
-            # Take the future job from the channel so that we have space for producing a new one right away
-            future_job = mining_channel.take_future_job()
-            assert (
-                future_job.uid == new_job_msg.job_id
-            ), "BUG: future job on channel {} doesn't match the produced message job ID {}".format(
-                future_job.uid, new_job_msg.job_id
-            )
+            # Take the future job from the channel so that we have space for producing
+            # a new one right away. It is the job of new_job_msg as the channel had no
+            # future jobs before
+            mining_channel.take_future_job()
             self._send_msg(new_job_msg)
             self._send_msg(
                 self.__build_set_new_prev_hash_msg(
-                    channel_id=mining_channel.id, future_job_id=new_job_msg.job_id
+                    channel_id=mining_channel.id,
+                    future_job_id=new_job_msg.job_id,
+                    prev_hash=self.pool.prev_hash,
+                    now=self.env.now,
                 )
             )
             # Send out another future job right away
@@ -228,45 +406,65 @@ class PoolV2(UpstreamConnectionProcessor):
                 )
             )
 
-    def visit_submit_shares_standard(self, msg: SubmitSharesStandard):
-        """
-        TODO: implement aggregation of sending SubmitSharesSuccess for a batch of successful submits
+    def __can_open_channel(self, msg: OpenStandardMiningChannel):
+        """Tells whether the requested channel is compatible with this node
+
+        Extended channels would also have to check the requested extranonce size
         """
-        channel = self._mining_channel_registry.get_channel(msg.channel_id)
+        return msg.max_target <= self._diff_1_target
 
-        assert (
-            channel.conn_uid == self.connection.uid
-        ), "Channel conn UID({}) doesn't match current conn UID({})".format(
-            channel.conn_uid, self.connection.uid
-        )
+    def visit_submit_shares_standard(self, msg: SubmitSharesStandard):
+        channel = self._mining_channel_registry.get_channel(msg.channel_id)
         self.__emit_channel_msg_on_bus(msg)
 
-        def on_accept(diff_target: coins.Target):
-            resp_msg = SubmitSharesSuccess(
-                channel.id,
-                last_sequence_number=msg.sequence_number,
-                new_submits_accepted_count=1,
-                new_shares_sum=diff_target.to_difficulty(),
-            )
-            self._send_msg(resp_msg)
-            self.__emit_channel_msg_on_bus(resp_msg)
-
-        def on_reject(_diff_target: coins.Target):
+        if channel is None or channel.conn_uid != self.connection.uid:
+            # The submit doesn't refer any job we know about
+            self.pool.account_rejected_submits()
             resp_msg = SubmitSharesError(
-                channel.id,
-                sequence_number=msg.sequence_number,
-                error_code='Share rejected',
+                msg.channel_id, msg.sequence_number, INVALID_CHANNEL_ID_ERROR_CODE
             )
             self._send_msg(resp_msg)
             self.__emit_channel_msg_on_bus(resp_msg)
+            return
 
         self.pool.process_submit(
-            msg.job_id, channel.session, on_accept=on_accept, on_reject=on_reject
+            msg.job_id,
+            channel.session,
+            on_accept=functools.partial(
+                self.__on_share_accepted, channel.id, msg.sequence_number
+            ),
+            on_reject=functools.partial(
+                self.__on_share_rejected, channel.id, msg.sequence_number
+            ),
         )
 
     def visit_submit_shares_extended(self, msg: SubmitSharesStandard):
         pass
 
+    def __on_share_accepted(
+        self, channel_id, sequence_number, diff_target: coins.Target
+    ):
+        self._shares_ack.ack_accepted_share(
+            channel_id, sequence_number, diff_target.to_difficulty()
+        )
+
+    def __on_share_rejected(
+        self, channel_id, sequence_number, _diff_target: coins.Target
+    ):
+        # Acknowledge the preceding accepted shares first to retain ordering
+        self._shares_ack.flush(channel_id)
+        resp_msg = SubmitSharesError(
+            channel_id,
+            sequence_number=sequence_number,
+            error_code=SHARE_REJECTED_ERROR_CODE,
+        )
+        self._send_msg(resp_msg)
+        self.__emit_channel_msg_on_bus(resp_msg)
+
+    def __send_submit_ack(self, msg: SubmitSharesSuccess):
+        self._send_msg(msg)
+        self.__emit_channel_msg_on_bus(msg)
+
     def _on_vardiff_change(self, session: MiningSession):
         """Handle difficulty change for the current session.
 
@@ -294,12 +492,15 @@ class PoolV2(UpstreamConnectionProcessor):
            job is being shared by multiple channels.
         """
         # Pool currently doesn't support grouping channels, all channels belong to
-        # group 0. We set the prev hash for all channels at once
-        # Retire current jobs in the registries of all channels
-        for channel in self._mining_channel_registry.channels:
+        # group 0. The prev hash is set for each channel individually, only the order
+        # of messages within a channel matters, so each channel is served in one pass
+        prev_hash = self.pool.prev_hash
+        now = self.env.now
+        for channel in self._mining_channel_registry.channels.values():
+            # Retire current jobs in the registry of the channel
             future_job = channel.take_future_job()
             prev_hash_msg = self.__build_set_new_prev_hash_msg(
-                channel.id, future_job.uid
+                channel.id, future_job.uid, prev_hash, now
             )
             channel.session.job_registry.retire_all_jobs()
             channel.session.job_registry.add_job(future_job)
@@ -307,20 +508,17 @@ class PoolV2(UpstreamConnectionProcessor):
             # invalidated. Any further submits for the invalidated jobs will be
             # rejected
             self._send_msg(prev_hash_msg)
-
-        # We can now broadcast future jobs to all channels for the upcoming block
-        for channel in self._mining_channel_registry.channels:
+            # The channel can now receive a future job for the upcoming block
             future_new_job_msg = self.__build_new_job_msg(channel, is_future_job=True)
             self._send_msg(future_new_job_msg)
 
-    def __build_set_new_prev_hash_msg(self, channel_id, future_job_id):
-        return SetNewPrevHash(
-            channel_id=channel_id,
-            job_id=future_job_id,
-            prev_hash=self.pool.prev_hash,
-            min_ntime=self.env.now,
-            nbits=None,
-        )
+    @staticmethod
+    def __build_set_new_prev_hash_msg(channel_id, future_job_id, prev_hash, now):
+        """Builds SetNewPrevHash, the caller supplies the values that are common to
+        all channels
+        """
+        # Positional arguments: channel_id, job_id, prev_hash, min_ntime, nbits
+        return SetNewPrevHash(channel_id, future_job_id, prev_hash, now, None)
 
     @staticmethod
     def __build_new_job_msg(mining_channel: PoolMiningChannel, is_future_job: bool):
@@ -333,39 +531,17 @@ class PoolV2(UpstreamConnectionProcessor):
         :param is_future_job: when true, the job won't be considered for the current prev
          hash known to the downstream node but for any future prev hash that explicitly
          selects it
-        :return New{Extended}MiningJob
+        :return New{Extended}MiningJob, for a future job its job_id is the UID of the
+         job that has just been queued as the newest future job of the channel
         """
         new_job = mining_channel.session.new_mining_job()
         if is_future_job:
             mining_channel.add_future_job(new_job)
 
         # Compose the protocol message based on actual channel type
-        if isinstance(mining_channel.cfg, OpenStandardMiningChannel):
-            msg = NewMiningJob(
-                channel_id=mining_channel.id,
-                job_id=new_job.uid,
-                future_job=is_future_job,
-                version=None,
-                merkle_root=Hash(),
-            )
-        elif isinstance(mining_channel.cfg, OpenExtendedMiningChannel):
-            msg = NewExtendedMiningJob(
-                channel_id=mining_channel.id,
-                job_id=new_job.uid,
-                future_job=is_future_job,
-                version=None,
-                version_rolling_allowed=True,  # TODO
-                merkle_path=MerklePath(),
-                cb_prefix=CoinBasePrefix(),
-                cb_suffix=CoinBaseSuffix(),
-            )
-        else:
-            assert False, 'Unsupported channel type: {}'.format(
-                mining_channel.cfg.channel_type
-            )
-
-        return msg
+        return mining_channel.job_msg_builder(mining_channel, new_job, is_future_job)
 
     def __emit_channel_msg_on_bus(self, msg: ChannelMessage):
         """Helper method for reporting a channel oriented message on the debugging bus."""
-        self._emit_protocol_msg_on_bus('Channel ID: {}'.format(msg.channel_id), msg)
+        # The log message is formatted only if anybody listens to the bus
+        self._emit_protocol_msg_on_bus('Channel ID: {}', msg, msg.channel_id)
@@ -24,6 +24,7 @@
 
 """
 import enum
+import random
 
 import sim_primitives.stratum_v1.messages as v1_messages
 
@@ -36,58 +37,96 @@ from sim_primitives.protocol import (
 )
 from sim_primitives.proxy import Proxy
 from sim_primitives.stratum_v2.messages import *
-from sim_primitives.stratum_v2.pool import ChannelRegistry
+from sim_primitives.stratum_v2.pool import (
+    ChannelRegistry,
+    SharesAckAggregator,
+    SHARE_REJECTED_ERROR_CODE,
+)
 from sim_primitives.stratum_v2.types import (
     DownstreamConnectionFlags,
     UpstreamConnectionFlags,
+    Hash,
 )
 
+# Jobs without a merkle branch share a single merkle root placeholder
+_EMPTY_HASH = Hash()
+
+
+class ChannelParams:
+    """Parameters of the V2 mining channel that is being translated to V1"""
+
+    __slots__ = (
+        'req_id',
+        'channel_id',
+        'group_channel_id',
+        'user_identity',
+        'extranonce_prefix',
+        'target',
+        'error_code',
+    )
+
+    def __init__(self):
+        self.req_id = None
+        self.channel_id = None
+        self.group_channel_id = None
+        self.user_identity = None
+        self.extranonce_prefix = None
+        self.target = None
+        self.error_code = None
+
 
 class V1Client(DownstreamConnectionProcessor):
-    def __init__(self, translation, connection: Connection, msg_handler_map):
-        self.msg_handler_map = msg_handler_map
+    _fast_path_messages = (v1_messages.OkResult, v1_messages.Notify)
+
+    def __init__(self, translation, connection: Connection):
+        """
+        :param translation: V2ToV1Translation that handles the V1 responses, see
+        _V1_RESULT_HANDLERS
+        """
+        self.translation = translation
         super().__init__(translation.name, translation.env, translation.bus, connection)
 
-    def subscribe_and_authorize(self):
+    def configure_authorize_and_subscribe(self, configure_req):
+        """Pipelines the complete V1 connection setup in a single batch
 
+        The responses are matched with the requests by their request IDs.
+        """
         auth_req = v1_messages.Authorize(
             req_id=None, user_name='some_miner', password='x'
         )
-        self.send_request(auth_req)
-
         sbscr_req = v1_messages.Subscribe(
             req_id=None, signature='some_signature', extranonce1=None, url='some_url'
         )
-        self.send_request(sbscr_req)
+        self.send_requests((configure_req, auth_req, sbscr_req))
 
     def visit_ok_result(self, msg):
         req = self.request_registry.pop(msg.req_id)
         if req:
-            self.msg_handler_map[type(req)](msg)
+            _V1_RESULT_HANDLERS[type(req)](self.translation, msg)
 
     def visit_error_result(self, msg):
         req = self.request_registry.pop(msg.req_id)
         if req:
-            self.msg_handler_map[type(req)](msg)
+            _V1_RESULT_HANDLERS[type(req)](self.translation, msg)
             self._emit_protocol_msg_on_bus(
-                "Error code {}, '{}' for request".format(msg.code, msg.msg), req
+                "Error code {}, '{}' for request", req, msg.code, msg.msg
             )
 
     def visit_subscribe_response(self, msg):
         req = self.request_registry.pop(msg.req_id)
         if req:
-            self.msg_handler_map[type(msg)](msg)
+            _V1_RESULT_HANDLERS[type(msg)](self.translation, msg)
 
     def visit_configure_response(self, msg):
         req = self.request_registry.pop(msg.req_id)
         if req:
-            self.msg_handler_map[type(msg)](msg)
+            _V1_RESULT_HANDLERS[type(msg)](self.translation, msg)
 
     def visit_set_difficulty(self, msg):
-        self.msg_handler_map[type(msg)](msg)
+        _V1_RESULT_HANDLERS[type(msg)](self.translation, msg)
 
     def visit_notify(self, msg):
-        self.msg_handler_map[type(msg)](msg)
+        _V1_RESULT_HANDLERS[type(msg)](self.translation, msg)
 
     def _on_invalid_message(self, msg):
         self._emit_protocol_msg_on_bus('Received invalid message', msg)
@@ -96,25 +135,38 @@ class V1Client(DownstreamConnectionProcessor):
 class V2ToV1Translation(UpstreamConnectionProcessor):
     """Processes all messages on 1 connection
 
+    Shares accepted by the upstream V1 server are acknowledged downstream as described
+    in SharesAckAggregator.
     """
 
-    class State(enum.Enum):
+    _fast_path_messages = (SubmitSharesStandard,)
+
+    class State(enum.IntEnum):
         # No message received yet
-        INIT = enum.auto()
+        INIT = 0
         # Stratum V1 mining.configure is in progress
-        V1_CONFIGURE = enum.auto()
+        V1_CONFIGURE = 1
         # Connection successfully setup, waiting for OpenMiningChannel message
-        CONNECTION_SETUP = enum.auto()
+        CONNECTION_SETUP = 2
         # Channel now needs finalization of subscribe+authorize+set difficulty
         # target with the upstream V1 server
-        OPEN_MINING_CHANNEL_PENDING = enum.auto()
+        OPEN_MINING_CHANNEL_PENDING = 3
         # Upstream subscribe/authorize failed state ensures sending
         # OpenMiningChannelError only once
-        V1_SUBSCRIBE_OR_AUTHORIZE_FAIL = enum.auto()
+        V1_SUBSCRIBE_OR_AUTHORIZE_FAIL = 4
         # Channel is operational
-        OPERATIONAL = enum.auto()
+        OPERATIONAL = 5
 
-    def __init__(self, proxy: Proxy, connection):
+    def __init__(
+        self, proxy: Proxy, connection, submit_ack_delay=None, max_pending_acks=32
+    ):
+        """
+        :param submit_ack_delay: time in seconds for aggregating acknowledgements of
+        accepted shares, see SharesAckAggregator. None acknowledges each share
+        immediately
+        :param max_pending_acks: number of accepted shares that are acknowledged
+        immediately regardless of submit_ack_delay
+        """
         self.proxy = proxy
         self.connection_config = None
         self.state = self.State.INIT
@@ -123,36 +175,28 @@ class V2ToV1Translation(UpstreamConnectionProcessor):
         self.user_identity = None
 
         self.v2_config = None
-        self.v2_mining_channel_params = dict()
+        self.channel_params = ChannelParams()
+        # V2 sequence numbers of forwarded shares indexed by the V1 submit request ID
+        self._submit_sequence_numbers = dict()
+        self._shares_ack = SharesAckAggregator(
+            proxy.env, self._send_msg, submit_ack_delay, max_pending_acks
+        )
 
         self.v1_client = None
         self.v1_authorized = False
-        self.v1_result_handler_map = {
-            v1_messages.Authorize: self.handle_authorize_response,
-            v1_messages.SubscribeResponse: self.handle_subscribe_response,
-            v1_messages.ConfigureResponse: self.handle_configure_response,
-            v1_messages.SetDifficulty: self.handle_set_difficulty,
-            v1_messages.Notify: self.handle_notify,
-            v1_messages.ErrorResult: self.handle_error_result_response,
-            v1_messages.Submit: self.handle_submit_response,
-        }
+        # Most recent V1 job received before the mining channel has been opened
+        self._pending_notify = None
+        # Previous block hash that the downstream channel has been switched to
+        self._last_prev_hash = None
         super().__init__(proxy.name, proxy.env, proxy.bus, connection)
 
     def handle_authorize_response(self, msg: Message):
         self.v1_authorized = True
-
-        if (
-            self.v2_mining_channel_params.get('extranonce_prefix')
-            and self.state == self.State.OPEN_MINING_CHANNEL_PENDING
-        ):
-            self.state = self.State.OPERATIONAL
-            self._send_open_mining_channel(success=True)
+        self.__try_complete_open_mining_channel()
 
     def handle_subscribe_response(self, msg: Message):
-        self.v2_mining_channel_params['extranonce_prefix'] = msg.extranonce1
-        if self.v1_authorized and self.state == self.State.OPEN_MINING_CHANNEL_PENDING:
-            self.state = self.State.OPERATIONAL
-            self._send_open_mining_channel(success=True)
+        self.channel_params.extranonce_prefix = msg.extranonce1
+        self.__try_complete_open_mining_channel()
 
     def handle_configure_response(self, msg: Message):
         if self.state == self.State.V1_CONFIGURE:
@@ -163,65 +207,77 @@ class V2ToV1Translation(UpstreamConnectionProcessor):
         self.state = self.State.V1_SUBSCRIBE_OR_AUTHORIZE_FAIL
 
     def handle_submit_response(self, msg: Message):
-        if isinstance(msg, v1_messages.OkResult):
-            self._send_msg(
-                SubmitSharesSuccess(
-                    channel_id=self.v2_mining_channel_params.get('channel_id'),
-                    last_sequence_number=self.v2_mining_channel_params.get('seq_num'),
-                    new_submits_accepted_count=1,
-                    new_shares_sum=self.v2_mining_channel_params.get(
-                        'target'
-                    ).to_difficulty(),
-                )
+        # The entry is dropped regardless of the result
+        sequence_number = self._submit_sequence_numbers.pop(msg.req_id, None)
+        # V1 result messages are never subclassed, compare the exact type
+        msg_type = type(msg)
+        channel_id = self.channel_params.channel_id
+        if msg_type is v1_messages.OkResult:
+            self._shares_ack.ack_accepted_share(
+                channel_id, sequence_number, self.channel_params.target.to_difficulty()
             )
-        elif isinstance(msg, v1_messages.ErrorResult):
+        elif msg_type is v1_messages.ErrorResult:
+            # Acknowledge the preceding accepted shares first to retain ordering
+            self._shares_ack.flush(channel_id)
             self._send_msg(
                 SubmitSharesError(
-                    channel_id=self.v2_mining_channel_params.get('channel_id'),
-                    sequence_number=self.v2_mining_channel_params.get(
-                        'sequence_number'
-                    ),
-                    error_code='Share rejected',
+                    channel_id, sequence_number, SHARE_REJECTED_ERROR_CODE
                 )
             )
 
     def handle_set_difficulty(self, msg: Message):
-        self.v2_mining_channel_params['target'] = msg.diff
-        self._send_msg(
-            SetTarget(
-                channel_id=self.v2_mining_channel_params.get('channel_id'),
-                max_target=msg.diff,
-            )
-        )
+        self.channel_params.target = msg.diff
+        # The upstream is set up before the downstream opens the channel, the target
+        # of a pending channel is sent once the channel is open
+        if self.state == self.State.OPERATIONAL:
+            self._send_msg(SetTarget(self.channel_params.channel_id, msg.diff))
 
     def handle_notify(self, msg: Message):
-        v2_new_prev_hash = SetNewPrevHash(
-            channel_id=self.v2_mining_channel_params.get('channel_id'),
-            job_id=msg.job_id,
-            prev_hash=msg.prev_hash,
-            min_ntime=msg.time,
-            nbits=msg.bits,
-        )
-        self._send_msg(v2_new_prev_hash)
+        if self.state == self.State.OPERATIONAL:
+            self.__forward_notify(msg)
+        else:
+            self._pending_notify = msg
 
-        v2_new_job = NewMiningJob(
-            channel_id=self.v2_mining_channel_params.get('channel_id'),
-            job_id=msg.job_id,
-            future_job=False,
-            merkle_root=msg.merkle_branch[0] if msg.merkle_branch else Hash(),
-            version=0,
+    def __forward_notify(self, msg: v1_messages.Notify):
+        """Translates the V1 job into V2 messages
+
+        Only a job on a new previous block hash is sent as a future job that is
+        immediately activated by SetNewPrevHash. Any other job (e.g. after difficulty
+        change) is sent as a single NewMiningJob.
+        """
+        channel_id = self.channel_params.channel_id
+        is_new_prev_hash = msg.prev_hash != self._last_prev_hash
+        # Positional arguments: channel_id, job_id, future_job, version, merkle_root
+        self._send_msg(
+            NewMiningJob(
+                channel_id,
+                msg.job_id,
+                is_new_prev_hash,
+                0,
+                msg.merkle_branch[0] if msg.merkle_branch else _EMPTY_HASH,
+            )
         )
-        self._send_msg(v2_new_job)
+        if is_new_prev_hash:
+            self._last_prev_hash = msg.prev_hash
+            # Both messages are delayed independently, SetNewPrevHash still finds the
+            # future job as the miner processes its receive store in FIFO order
+            # Positional arguments: channel_id, job_id, prev_hash, min_ntime, nbits
+            self._send_msg(
+                SetNewPrevHash(
+                    channel_id, msg.job_id, msg.prev_hash, msg.time, msg.bits
+                )
+            )
 
     def visit_setup_connection(self, msg: SetupConnection):
-        if self.state in (self.State.INIT,):
+        if self.state == self.State.INIT:
             # arbitrary for now
-            response_flags = set()
-            if DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING not in msg.flags:
-                response_flags.add(UpstreamConnectionFlags.REQUIRES_FIXED_VERSION)
+            response_flags = UpstreamConnectionFlags(0)
+            if not msg.flags & DownstreamConnectionFlags.REQUIRES_VERSION_ROLLING:
+                response_flags |= UpstreamConnectionFlags.REQUIRES_FIXED_VERSION
 
             self.v2_config = SetupConnectionSuccess(
-                used_version=min(msg.min_version, msg.max_version), flags=set()
+                used_version=min(msg.min_version, msg.max_version),
+                flags=response_flags,
             )
 
             # TODO fill out actual extension parameters
@@ -233,53 +289,82 @@ class V2ToV1Translation(UpstreamConnectionProcessor):
             conn = self.proxy.upstream_connection_factory.create_connection()
             conn.connect_to(self.proxy.upstream_node)
 
-            self.v1_client = V1Client(self, conn, self.v1_result_handler_map)
-            self.v1_client.send_request(configure_msg)
+            self.v1_client = V1Client(self, conn)
+            # Authorize and subscribe right away so that the upstream is ready by the
+            # time the downstream opens a mining channel
+            self.v1_client.configure_authorize_and_subscribe(configure_msg)
             self.state = self.State.V1_CONFIGURE
         else:
-            self._send_msg(SetupConnectionError('Connection can only be setup once'))
+            self._send_msg(
+                SetupConnectionError(
+                    DownstreamConnectionFlags(0), 'Connection can only be setup once'
+                )
+            )
 
     def visit_open_standard_mining_channel(self, msg: OpenStandardMiningChannel):
-        import random
-
         self.state = self.State.OPEN_MINING_CHANNEL_PENDING
-        self.v2_mining_channel_params.update(
-            req_id=msg.req_id,
-            channel_id=random.randrange(2 ** 32),
-            group_channel_id=0,
-            user_identity=msg.user_identity,
-        )
-        self.v1_client.subscribe_and_authorize()
+        params = self.channel_params
+        params.req_id = msg.req_id
+        params.channel_id = random.getrandbits(32)
+        params.group_channel_id = 0
+        params.user_identity = msg.user_identity
+        self.__try_complete_open_mining_channel()
+
+    def __try_complete_open_mining_channel(self):
+        """Opens the pending mining channel once the upstream is authorized and
+        subscribed
+
+        The upstream target and the most recent upstream job that have been received
+        before the channel was open follow the open channel response. The downstream
+        thus receives the same sequence of messages as when the upstream was set up
+        only after the channel had been requested.
+        """
+        params = self.channel_params
+        if (
+            self.v1_authorized
+            and params.extranonce_prefix
+            and self.state == self.State.OPEN_MINING_CHANNEL_PENDING
+        ):
+            self.state = self.State.OPERATIONAL
+            self._send_open_mining_channel(success=True)
+            if params.target is not None:
+                self._send_msg(SetTarget(params.channel_id, params.target))
+            if self._pending_notify is not None:
+                self.__forward_notify(self._pending_notify)
+                self._pending_notify = None
 
     def visit_open_extended_mining_channel(self, msg: OpenExtendedMiningChannel):
         pass
 
     def visit_submit_shares_standard(self, msg: SubmitSharesStandard):
-        """
-        TODO: implement aggregation of sending SubmitSharesSuccess for a batch of successful submits
-        """
-        assert msg.channel_id == self.v2_mining_channel_params.get('channel_id')
+        assert msg.channel_id == self.channel_params.channel_id
         # msg.version
-        self.v2_mining_channel_params['sequence_number'] = msg.sequence_number
-        self.v1_client.send_request(
-            v1_messages.Submit(
-                req_id=None,
-                user_name=self.v2_mining_channel_params.get('user_identity'),  # TODO
-                job_id=msg.job_id,
-                extranonce2=None,
-                time=msg.ntime,
-                nonce=msg.nonce,
-            )
+        submit = v1_messages.Submit(
+            req_id=None,
+            user_name=self.channel_params.user_identity,  # TODO
+            job_id=msg.job_id,
+            extranonce2=None,
+            time=msg.ntime,
+            nonce=msg.nonce,
         )
+        self.v1_client.send_request(submit)
+        # The request ID has been assigned by sending the request
+        self._submit_sequence_numbers[submit.req_id] = msg.sequence_number
         self.__emit_channel_msg_on_bus(msg)
 
     def __emit_channel_msg_on_bus(self, msg: ChannelMessage):
         """Helper method for reporting a channel oriented message on the debugging bus."""
-        self._emit_protocol_msg_on_bus('Channel ID: {}'.format(msg.channel_id), msg)
+        self._emit_protocol_msg_on_bus('Channel ID: {}', msg, msg.channel_id)
 
     def terminate(self):
+        # Accepted shares are acknowledged before the connection goes down
+        self._shares_ack.flush_all()
         super().terminate()
-        for channel in self._mining_channel_registry.channels:
+        # Responses to the forwarded submits won't be processed anymore
+        self._submit_sequence_numbers.clear()
+        self._pending_notify = None
+        # Snapshot the channels as terminating them may alter the registry
+        for channel in list(self._mining_channel_registry.channels.values()):
             channel.terminate()
 
     def _on_invalid_message(self, msg):
@@ -289,21 +374,20 @@ class V2ToV1Translation(UpstreamConnectionProcessor):
         pass
 
     def _send_open_mining_channel(self, success: bool):
+        params = self.channel_params
         v2_mining_channel = (
+            # Positional arguments: req_id, channel_id, target, extranonce_prefix,
+            # group_channel_id
             OpenStandardMiningChannelSuccess(
-                req_id=self.v2_mining_channel_params.get('req_id'),
-                channel_id=self.v2_mining_channel_params.get('channel_id'),
-                target=self.v2_mining_channel_params.get('target'),
-                extranonce_prefix=self.v2_mining_channel_params.get(
-                    'extranonce_prefix'
-                ),
-                group_channel_id=self.v2_mining_channel_params.get('group_channel_id'),
+                params.req_id,
+                params.channel_id,
+                # V2 carries the raw target, the upstream target may be unknown yet
+                params.target.target if params.target is not None else None,
+                params.extranonce_prefix,
+                params.group_channel_id,
             )
             if success
-            else OpenMiningChannelError(
-                req_id=self.v2_mining_channel_params.get('req_id'),
-                error_code=self.v2_mining_channel_params.get('error_code'),
-            )
+            else OpenMiningChannelError(params.req_id, params.error_code)
         )
         self._send_msg(v2_mining_channel)
         self.__emit_channel_msg_on_bus(v2_mining_channel)
@@ -405,3 +489,16 @@ class V2ToV1Translation(UpstreamConnectionProcessor):
     #         )
     #
     #     return msg
+
+
+# Handlers of V2ToV1Translation for the V1 responses and messages received by V1Client
+# indexed by the type of the V1 request or message
+_V1_RESULT_HANDLERS = {
+    v1_messages.Authorize: V2ToV1Translation.handle_authorize_response,
+    v1_messages.SubscribeResponse: V2ToV1Translation.handle_subscribe_response,
+    v1_messages.ConfigureResponse: V2ToV1Translation.handle_configure_response,
+    v1_messages.SetDifficulty: V2ToV1Translation.handle_set_difficulty,
+    v1_messages.Notify: V2ToV1Translation.handle_notify,
+    v1_messages.ErrorResult: V2ToV1Translation.handle_error_result_response,
+    v1_messages.Submit: V2ToV1Translation.handle_submit_response,
+}
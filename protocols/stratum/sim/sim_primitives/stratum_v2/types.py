@@ -43,31 +43,31 @@ class MiningChannelType(enum.Enum):
     EXTENDED = 1
 
 
-class DownstreamConnectionFlags(enum.Enum):
-    """Flags provided by downstream node"""
+class DownstreamConnectionFlags(enum.IntFlag):
+    """Flags provided by downstream node, each flag is a bit of the flags field"""
 
     #: The downstream node requires standard jobs. It doesn’t understand group channels - it is unable to process
     #: extended jobs sent to standard channels thru a group channel.
-    REQUIRES_STANDARD_JOBS = 0
+    REQUIRES_STANDARD_JOBS = 1 << 0
 
     #: If set, the client notifies the server that it will send SetCustomMiningJob on this connection
-    REQUIRES_WORK_SELECTION = 1
+    REQUIRES_WORK_SELECTION = 1 << 1
 
     #: The client requires version rolling for efficiency or correct operation and the server MUST NOT send jobs
     #: which do not allow version rolling.
-    REQUIRES_VERSION_ROLLING = 2
+    REQUIRES_VERSION_ROLLING = 1 << 2
 
 
-class UpstreamConnectionFlags(enum.Enum):
-    """Flags provided by upstream node"""
+class UpstreamConnectionFlags(enum.IntFlag):
+    """Flags provided by upstream node, each flag is a bit of the flags field"""
 
     #: Upstream node will not accept any changes to the version field. Note that if REQUIRES_VERSION_ROLLING was set
     #: in the SetupConnection::flags field, this bit MUST NOT be set. Further, if this bit is set, extended jobs MUST
     #: NOT indicate support for version rolling.
-    REQUIRES_FIXED_VERSION = 0
+    REQUIRES_FIXED_VERSION = 1 << 0
 
     #: Upstream node will not accept opening of a standard channel.
-    REQUIRES_EXTENDED_CHANNELS = 1
+    REQUIRES_EXTENDED_CHANNELS = 1 << 1
 
 
 class Hash:
@@ -20,18 +20,28 @@
 # of such proprietary license or if you have any other questions, please
 # contact us at opensource@braiins.com.
 import argparse
+import collections
+import functools
+import hashlib
 import multiprocessing
+import os
+import pickle
 
+import matplotlib
+
+# Plots are only stored into files, no interactive backend is needed
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 import simpy
-from event_bus import EventBus
 
+import sim_primitives
 import sim_primitives.coins as coins
 import sim_primitives.mining_params as mining_params
 from sim_primitives.miner import Miner
 from sim_primitives.network import Connection, ConnectionFactory
 from sim_primitives.pool import Pool
+from sim_primitives.protocol import SimEventBus
 from sim_primitives.proxy import Proxy
 from sim_primitives.stratum_v1.miner import MinerV1
 from sim_primitives.stratum_v1.pool import PoolV1
@@ -39,35 +49,81 @@ from sim_primitives.stratum_v2.miner import MinerV2
 from sim_primitives.stratum_v2.pool import PoolV2
 from sim_primitives.stratum_v2.proxy import V2ToV1Translation
 
-bus = EventBus()
+# Raw pool default target that corresponds to difficulty 100000, it is the same for
+# all simulations
+DEFAULT_TARGET = coins.Target.from_difficulty(
+    100000, mining_params.diff_1_target
+).target
+
+# Simulation results needed for plotting
+RESULTS_DTYPE = np.dtype(
+    [
+        ('accepted_submits', np.int64),
+        ('stale_submits', np.int64),
+        ('rejected_submits', np.int64),
+        ('latency', np.float64),
+    ]
+)
+
+
+# Worker processes are restarted after this many chunks of simulations to release any
+# state they accumulate. Higher values amortize the start of the workers better,
+# lower values keep their memory footprint smaller.
+MAX_TASKS_PER_WORKER = 8
+
+# Directory with results of already finished simulations
+CACHE_DIR = '.sim_cache'
+
+# File names (without extension) and protocol configurations of all plots, the length
+# of the simulation is specified on the command line
+PLOT_CONFIGS = (
+    ('v1v1', {'pool': PoolV1, 'miner': MinerV1}),
+    ('v2v2', {'pool': PoolV2, 'miner': MinerV2}),
+    ('v2v1', {'pool': PoolV1, 'miner': MinerV2, 'proxy': V2ToV1Translation}),
+)
+
+# Resolution of rasterized data points and of whole raster images
+PLOT_DPI = 120
 
 
-def sim_round(args):
+# Configuration of a single simulation, unspecified proxy means that the miners
+# connect directly to the pool
+SimConfig = collections.namedtuple(
+    'SimConfig',
+    ('pool', 'miner', 'proxy', 'limit', 'latency', 'seed', 'sweep'),
+    defaults=(None, 500, None, None, None),
+)
+
+
+def sim_round(config: SimConfig):
+    # Forked workers inherit the same random state, every simulation has to be seeded
+    np.random.seed(config.seed)
     env = simpy.Environment()
+    # No simulation shares any state with other simulations
+    bus = SimEventBus()
 
     pool = Pool(
         'pool1',
         env,
         bus,
-        protocol_type=args.get('pool'),
-        default_target=coins.Target.from_difficulty(
-            100000, mining_params.diff_1_target
-        ),
+        protocol_type=config.pool,
+        # Vardiff adjusts the target in place, each simulation needs its own instance
+        default_target=coins.Target(DEFAULT_TARGET, mining_params.diff_1_target),
         enable_vardiff=True,
         simulate_luck=True,
     )
     conn1 = Connection(
-        env, 'stratum', mean_latency=args.get('latency'), latency_stddev_percent=10
+        env, 'stratum', mean_latency=config.latency, latency_stddev_percent=10
     )
     conn2 = Connection(
-        env, 'stratum', mean_latency=args.get('latency'), latency_stddev_percent=10
+        env, 'stratum', mean_latency=config.latency, latency_stddev_percent=10
     )
     m1 = Miner(
         'miner1',
         env,
         bus,
         diff_1_target=mining_params.diff_1_target,
-        protocol_type=args.get('miner'),
+        protocol_type=config.miner,
         device_information=dict(
             speed_ghps=10000,
             vendor='Bitmain',
@@ -82,7 +138,7 @@ def sim_round(args):
         env,
         bus,
         diff_1_target=mining_params.diff_1_target,
-        protocol_type=args.get('miner'),
+        protocol_type=config.miner,
         device_information=dict(
             speed_ghps=13000,
             vendor='Bitmain',
@@ -93,16 +149,16 @@ def sim_round(args):
         simulate_luck=True,
     )
 
-    if args.get('proxy'):
+    if config.proxy:
         upstream = Proxy(
             'proxy',
             env,
             bus,
-            translation_type=args.get('proxy'),
+            translation_type=config.proxy,
             upstream_connection_factory=ConnectionFactory(
                 env=env,
                 port='stratum',
-                mean_latency=0.01,  # args.get('latency')  # this is small and constant
+                mean_latency=0.01,  # config.latency  # this is small and constant
             ),
             upstream_node=pool,
             default_target=pool.default_target,
@@ -113,7 +169,7 @@ def sim_round(args):
     m1.connect_to_pool(conn1, upstream)
     m2.connect_to_pool(conn2, upstream)
 
-    env.run(until=args.get('limit', 500))
+    env.run(until=config.limit)
 
     return {
         'accepted_shares': pool.accepted_shares,
@@ -121,43 +177,137 @@ def sim_round(args):
         'stale_shares': pool.stale_shares,
         'stale_submits': pool.stale_submits,
         'rejected_submits': pool.rejected_submits,
-        'latency': args.get('latency'),
+        'latency': config.latency,
+        'sweep': config.sweep,
     }
 
 
-def gen_plot(
-    args=None,
-    file_name='share_graphs.pdf',
-    latency_min=0.001,
-    latency_max=0.5,
-    number_of_points=50,
+@functools.lru_cache(maxsize=None)
+def sources_digest():
+    """Digest of all sources of the simulation including this script"""
+    package_dir = os.path.dirname(sim_primitives.__file__)
+    paths = [__file__]
+    for dir_path, dir_names, file_names in os.walk(package_dir):
+        # Walk the directories in a stable order
+        dir_names.sort()
+        paths.extend(
+            os.path.join(dir_path, name)
+            for name in sorted(file_names)
+            if name.endswith('.py')
+        )
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cached_sim_round(config: SimConfig):
+    """Runs sim_round() unless the same simulation has already been cached on disk
+
+    Simulations are seeded so that the configuration and the sources of the
+    simulation fully determine the result. Results of a changed simulation are
+    therefore never reused.
+    """
+    # The sweep index only tags the result, it doesn't influence the simulation
+    key = hashlib.blake2b(
+        (sources_digest() + repr(config._replace(sweep=None))).encode(), digest_size=16,
+    ).hexdigest()
+    path = os.path.join(CACHE_DIR, '{}.pickle'.format(key))
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except FileNotFoundError:
+        result = sim_round(config)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Other workers never see a partially written result
+        tmp_path = '{}.{}'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f)
+        os.replace(tmp_path, path)
+    result['sweep'] = config.sweep
+    return result
+
+
+def gen_params(sweeps, latency_min, latency_max, number_of_points):
+    """Generates simulation configurations for all latencies of all sweeps
+
+    Every configuration is tagged with the index of its sweep.
+    """
+    latencies = np.linspace(latency_min, latency_max, number_of_points)
+    for sweep, args in enumerate(sweeps):
+        sweep_config = SimConfig(sweep=sweep, **args)
+        for i, value in enumerate(latencies):
+            # Each point of the plot is reproducible on its own
+            yield sweep_config._replace(latency=value, seed=i)
+
+
+def run_sweeps(
+    sweeps, latency_min, latency_max, number_of_points, proc_pool, use_cache=False
 ):
-    def gen_params(args):
-        for value in np.linspace(latency_min, latency_max, number_of_points):
-            config = args.copy()
-            config['latency'] = value
-            yield config
+    """Simulates all latencies of all sweeps as one batch of tasks
+
+    Running the sweeps together keeps all workers busy until the very last
+    simulation instead of idling at the end of each sweep.
 
-    with multiprocessing.Pool() as proc_pool:
-        x = proc_pool.map(sim_round, gen_params(args))
+    :param sweeps: list of dicts with SimConfig fields for each sweep, the latency,
+    seed and sweep fields are filled in for every simulation
+    :param use_cache: reuse results of identical simulations from previous runs
+    :return: list of simulation results ordered by latency for each sweep
+    """
+    # Hand out several simulations per worker request, yet keep enough chunks to
+    # balance the load among the workers
+    chunksize = max(
+        1, len(sweeps) * number_of_points // (4 * multiprocessing.cpu_count())
+    )
+    sweep_results = [[] for _ in sweeps]
+    for result in proc_pool.imap_unordered(
+        cached_sim_round if use_cache else sim_round,
+        gen_params(sweeps, latency_min, latency_max, number_of_points),
+        chunksize=chunksize,
+    ):
+        sweep_results[result['sweep']].append(result)
+
+    # Results arrive in the order of completion, the plots need them ordered by
+    # latency
+    for results in sweep_results:
+        results.sort(key=lambda result: result['latency'])
+    return sweep_results
 
-    accepted_submits = np.array(list(map(lambda x: x['accepted_submits'], x)))
-    stale_submits = np.array(list(map(lambda x: x['stale_submits'], x)))
-    rejected_submits = np.array(list(map(lambda x: x['rejected_submits'], x)))
-    latencies = np.array(list(map(lambda x: x['latency'], x)))
 
-    all_shares = np.array(
+def plot_results(sim_results, file_name):
+    """Plots the results into a file, the file name extension determines its format
+
+    Data points are rasterized so that even vector formats stay small for large
+    numbers of points.
+    """
+    # All results are converted in a single pass into one structured array
+    results = np.array(
         [
-            sum(tripple)
-            for tripple in zip(accepted_submits, stale_submits, rejected_submits)
-        ]
+            (
+                result['accepted_submits'],
+                result['stale_submits'],
+                result['rejected_submits'],
+                result['latency'],
+            )
+            for result in sim_results
+        ],
+        dtype=RESULTS_DTYPE,
     )
+    accepted_submits = results['accepted_submits']
+    stale_submits = results['stale_submits']
+    rejected_submits = results['rejected_submits']
+    latencies = results['latency']
 
-    fig, (ax_tot, ax_acc, ax_stale, ax_rej) = plt.subplots(4, sharex=True)
-    ax_tot.plot(latencies, accepted_submits, 'o-')
-    ax_acc.plot(latencies, accepted_submits / all_shares, 'o-')
-    ax_stale.plot(latencies, stale_submits / all_shares, 'o-')
-    ax_rej.plot(latencies, rejected_submits / all_shares, 'o-')
+    all_shares = accepted_submits + stale_submits + rejected_submits
+
+    fig, (ax_tot, ax_acc, ax_stale, ax_rej) = plt.subplots(
+        4, sharex=True, figsize=(6, 8)
+    )
+    ax_tot.plot(latencies, accepted_submits, 'o-', rasterized=True)
+    ax_acc.plot(latencies, accepted_submits / all_shares, 'o-', rasterized=True)
+    ax_stale.plot(latencies, stale_submits / all_shares, 'o-', rasterized=True)
+    ax_rej.plot(latencies, rejected_submits / all_shares, 'o-', rasterized=True)
 
     ax_tot.set(title='Total number of accepted shares')
     ax_acc.set(title='Fraction of accepted shares')
@@ -165,14 +315,42 @@ def gen_plot(
     ax_rej.set(title='Fraction of rejected shares', xlabel='latency [s]')
 
     fig.subplots_adjust(hspace=0.5)
-    plt.savefig(file_name)
+    fig.savefig(file_name, dpi=PLOT_DPI, bbox_inches='tight')
+    # Release the figure, pyplot would keep it alive otherwise
+    plt.close(fig)
+
+
+def gen_plot(
+    args=None,
+    file_name='share_graphs.pdf',
+    latency_min=0.001,
+    latency_max=0.5,
+    number_of_points=50,
+    proc_pool=None,
+):
+    """Simulates all latencies of a single configuration in parallel and plots the
+    results
+
+    :param proc_pool: optional process pool for running the simulations, a new
+    pool is created for this plot only if not provided
+    """
+    if proc_pool is None:
+        with multiprocessing.Pool(maxtasksperchild=MAX_TASKS_PER_WORKER) as proc_pool:
+            (results,) = run_sweeps(
+                [args], latency_min, latency_max, number_of_points, proc_pool
+            )
+    else:
+        (results,) = run_sweeps(
+            [args], latency_min, latency_max, number_of_points, proc_pool
+        )
+    plot_results(results, file_name)
 
 
 def main():
     parser = argparse.ArgumentParser(
         prog='pool_proxy_miner_sim.py',
         description='Simulates interaction of a mining pool and two miners in V1-V1, V2-V2'
-        ' and V2-proxy-V1 configuration and stores result plots in 3 pdf files.',
+        ' and V2-proxy-V1 configuration and stores result plots in 3 files.',
     )
     parser.add_argument(
         '--latency_min',
@@ -192,34 +370,32 @@ def main():
     parser.add_argument(
         '--limit', help='Length of simulation (default 3000)', type=int, default=3000
     )
-    args = parser.parse_args()
-
-    gen_plot(
-        args={'pool': PoolV1, 'miner': MinerV1, 'limit': args.limit},
-        file_name='v1v1.pdf',
-        latency_min=args.latency_min,
-        latency_max=args.latency_max,
-        number_of_points=args.number_of_points,
-    )
-    gen_plot(
-        args={'pool': PoolV2, 'miner': MinerV2, 'limit': args.limit},
-        file_name='v2v2.pdf',
-        latency_min=args.latency_min,
-        latency_max=args.latency_max,
-        number_of_points=args.number_of_points,
+    parser.add_argument(
+        '--format',
+        help='Format of the plot files (default pdf)',
+        choices=('pdf', 'png', 'svg'),
+        default='pdf',
     )
-    gen_plot(
-        args={
-            'pool': PoolV1,
-            'miner': MinerV2,
-            'proxy': V2ToV1Translation,
-            'limit': args.limit,
-        },
-        file_name='v2v1.pdf',
-        latency_min=args.latency_min,
-        latency_max=args.latency_max,
-        number_of_points=args.number_of_points,
+    parser.add_argument(
+        '--cache',
+        help='Reuse results of identical simulations cached in {}'.format(CACHE_DIR),
+        action='store_true',
     )
+    args = parser.parse_args()
+
+    # All plots are simulated at once by a single set of worker processes
+    with multiprocessing.Pool(maxtasksperchild=MAX_TASKS_PER_WORKER) as proc_pool:
+        sweep_results = run_sweeps(
+            [dict(config, limit=args.limit) for _, config in PLOT_CONFIGS],
+            args.latency_min,
+            args.latency_max,
+            args.number_of_points,
+            proc_pool,
+            use_cache=args.cache,
+        )
+
+    for results, (file_name, _) in zip(sweep_results, PLOT_CONFIGS):
+        plot_results(results, '{}.{}'.format(file_name, args.format))
 
 
 if __name__ == '__main__':